@@ -23,7 +23,7 @@ def gradio_interface():
         # Return updated history, clear the input textbox, and update display_image with image_data
         return updated_history, "", image_data
 
-    async def submit_message(message, chat_history, img):
+    async def submit_message(message, chat_history, img, request: gr.Request):
         # Immediately append the user's message to chat history
         if chat_history is None:
             chat_history = []
@@ -33,7 +33,8 @@ def gradio_interface():
         yield chat_history, "", img
         
         # Now stream the assistant's response and update the chat
-        async for updated_history, textbox, image_data in client.process_message(message, chat_history, img):
+        session_id = request.session_hash if request else None
+        async for updated_history, textbox, image_data in client.process_message(message, chat_history, img, session_id=session_id):
             yield updated_history, textbox, image_data
     
     with gr.Blocks(title="MCP Weather Client") as demo:
@@ -102,8 +103,6 @@ def gradio_interface():
         return demo
 
 async def main():
-    client = MCPClientWrapper()
-    
     await client.check_connection()
     await client._connect()
     interface = gradio_interface()
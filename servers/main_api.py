@@ -1,20 +1,41 @@
-import base64
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import asyncio
 from io import BytesIO
-from fastapi import FastAPI
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import traceback
+from PIL import Image
 import torch
 from transformers import AutoModelForCausalLM
 
 from diffusers import DiffusionPipeline
-from diffusers import EulerDiscreteScheduler
+from diffusers import EulerDiscreteScheduler, DPMSolverMultistepScheduler
 
 from deepseek_vl.models import VLChatProcessor, MultiModalityCausalLM
-from deepseek_vl.utils.io import load_pil_images
+
+from utils.image_store import ImageStore, image_digest
+from utils.micro_batcher import MicroBatcher
+from utils.jobs import Job, JobRegistry
+from utils.inference_backend import InferenceBackend
+from utils.image_cache import ImageCache, request_key
+
+# Device, precision and thread settings come from INFERENCE_* / TORCH_NUM_* env vars
+backend = InferenceBackend()
+backend.configure()
+
+DIFFUSION_MODEL = "stabilityai/stable-diffusion-2"
 
 def load_diffuser():
-    image_model = DiffusionPipeline.from_pretrained("stabilityai/stable-diffusion-2", use_safetensors=True, safety_checker=None).to("mps")
-    image_model.scheduler = EulerDiscreteScheduler.from_config(image_model.scheduler.config)
-    image_model.enable_attention_slicing()
+    image_model = DiffusionPipeline.from_pretrained(DIFFUSION_MODEL, use_safetensors=True, safety_checker=None)
+    image_model = backend.prepare_diffusion(image_model)
+    # Saves accelerator memory, on cpu it only costs speed
+    if backend.device != "cpu":
+        image_model.enable_attention_slicing()
     return image_model
 
 def load_visual_llm():
@@ -24,93 +45,275 @@ def load_visual_llm():
     tokenizer = vl_chat_processor.tokenizer
 
     vl_gpt: MultiModalityCausalLM = AutoModelForCausalLM.from_pretrained(model_path, trust_remote_code=True)
-    vl_gpt = vl_gpt.to(torch.bfloat16)
-    vl_gpt = vl_gpt.to("mps").eval()
+    vl_gpt = backend.prepare_model(vl_gpt)
     return vl_chat_processor, vl_gpt, tokenizer
 
 img_model = load_diffuser()
 vl_chat_processor, vl_gpt, tokenizer = load_visual_llm()
 
+# Fast zlib level: generated images are sent right away, encode time matters more than size
+PNG_COMPRESS_LEVEL = int(os.getenv("PNG_COMPRESS_LEVEL", "1"))
+
+# Requests arriving within the window with the same pipeline settings share one pipeline call
+DIFFUSION_MAX_BATCH = int(os.getenv("DIFFUSION_MAX_BATCH", "4"))
+DIFFUSION_BATCH_WINDOW_MS = float(os.getenv("DIFFUSION_BATCH_WINDOW_MS", "50"))
+
+# Speed/quality tiers: scheduler, denoising steps, guidance and default/max image side
+IMAGE_TIERS = {
+    "preview": {"scheduler": "dpm", "steps": 12, "guidance": 6.0, "size": 512, "max_size": 512},
+    "standard": {"scheduler": "dpm", "steps": 25, "guidance": 7.5, "size": 768, "max_size": 768},
+    "high": {"scheduler": "euler", "steps": 50, "guidance": 9.0, "size": 768, "max_size": 1024},
+}
+IMAGE_DEFAULT_TIER = os.getenv("IMAGE_DEFAULT_TIER", "preview")
+IMAGE_MIN_SIZE = 256
+
+# Built once from the pipeline's config, each batch switches to the one of its tier
+schedulers = {
+    "dpm": DPMSolverMultistepScheduler.from_config(img_model.scheduler.config),
+    "euler": EulerDiscreteScheduler.from_config(img_model.scheduler.config),
+}
+
+def image_size(value: int | None, tier: dict) -> int:
+    """Side length the pipeline accepts: a multiple of 8 within the tier's bounds."""
+    if not value:
+        return tier["size"]
+    return min(max(round(value / 8) * 8, IMAGE_MIN_SIZE), tier["max_size"])
+
+def image_settings(tier_name: str | None, width: int | None, height: int | None) -> tuple:
+    """Pipeline arguments for a request, requests with equal settings can share a batch."""
+    tier = IMAGE_TIERS.get(tier_name or IMAGE_DEFAULT_TIER)
+    if tier is None:
+        raise ValueError(f"Unknown tier {tier_name!r}, expected one of {', '.join(IMAGE_TIERS)}")
+    return (
+        ("scheduler", tier["scheduler"]),
+        ("width", image_size(width, tier)),
+        ("height", image_size(height, tier)),
+        ("num_inference_steps", tier["steps"]),
+        ("guidance_scale", tier["guidance"]),
+    )
+
+def image_seed(prompt: str, seed: int | None) -> int:
+    """Seed of a request, derived from the prompt when none is given so repeated prompts hit the cache."""
+    if seed is None:
+        return int(request_key(prompt=prompt)[:8], 16)
+    # torch.Generator takes a signed 64-bit seed, a bad one would fail the whole batch it joins
+    if not 0 <= seed < 2**63:
+        raise ValueError(f"seed must be between 0 and 2**63 - 1, got {seed}")
+    return seed
+
+def encode_png(image: Image.Image) -> bytes:
+    buffered = BytesIO()
+    image.save(buffered, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+    return buffered.getvalue()
+
+def run_diffusion_batch(settings: tuple, jobs: list) -> list:
+    """Run one pipeline call for a batch of jobs on the batcher thread, returns the PNG bytes of each.
+
+    Each job gets its own generator seeded with its seed, so an image does not
+    depend on the batch it ran in. Every step reports progress to all jobs of the
+    batch. The pipeline is only interrupted once all of them were cancelled, the
+    others still need the run.
+    """
+    def on_step_end(pipe, step, timestep, callback_kwargs):
+        for job in jobs:
+            job.report(step + 1, pipe.num_timesteps)
+        if all(job.cancel_requested for job in jobs):
+            pipe._interrupt = True
+        return callback_kwargs
+
+    kwargs = dict(settings)
+    img_model.scheduler = schedulers[kwargs.pop("scheduler")]
+    for job in jobs:
+        job.report(0)
+    with backend.inference():
+        images = img_model(
+            prompt=[job.payload["prompt"] for job in jobs],
+            generator=[torch.Generator("cpu").manual_seed(job.payload["seed"]) for job in jobs],
+            callback_on_step_end=on_step_end,
+            **kwargs
+        ).images
+    if all(job.cancel_requested for job in jobs):
+        return [None] * len(jobs)
+    # Encode once here, off the event loop, the same bytes are cached and sent
+    results = [encode_png(image) for image in images]
+    for job, img_bytes in zip(jobs, results):
+        # A full or read-only cache dir must not throw away the generated images
+        try:
+            image_cache.put(job.payload["cache_key"], img_bytes)
+        except Exception as e:
+            print(f"[SERVER][IMAGE_CACHE] Failed to cache {job.id}: {e}")
+    return results
+
+diffusion_batcher = MicroBatcher(
+    run_diffusion_batch,
+    max_batch_size=DIFFUSION_MAX_BATCH,
+    max_wait=DIFFUSION_BATCH_WINDOW_MS / 1000
+)
+image_jobs = JobRegistry()
+image_cache = ImageCache()
+# The vision model gets its own thread, describing an image never blocks the event loop either
+vision_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vision")
+
+async def run_image_job(job: Job) -> bytes:
+    cached = await asyncio.to_thread(image_cache.get, job.payload["cache_key"])
+    if cached is not None:
+        print(f"[SERVER][IMAGE_JOB] Cache hit for {job.id}")
+        return cached
+    return await diffusion_batcher.submit(job.payload["settings"], job)
+
+def submit_image_job(prompt: str, settings: tuple, seed: int) -> Job:
+    cache_key = request_key(model=DIFFUSION_MODEL, prompt=prompt, seed=seed, settings=settings)
+    payload = {"prompt": prompt, "settings": settings, "seed": seed, "cache_key": cache_key}
+    return image_jobs.submit(payload, run_image_job)
+
+# Decoded uploads by content hash, follow-up questions about an image skip the upload and decode
+decoded_images = ImageStore(sizeof=lambda image: image.width * image.height * len(image.getbands()))
+
 app = FastAPI(title="API SERVER")
 
 @app.get("/get-health")
 def get_server_health():
     return {"status": "ok"}
 
+@app.get("/metrics")
+def get_metrics():
+    return {
+        "inference": backend.snapshot(),
+        "diffusion_batcher": diffusion_batcher.snapshot(),
+        "image_cache": image_cache.snapshot(),
+    }
+
 @app.get("/image/generate")
-async def generate_image(prompt: str, width: int = 512, height: int = 512) -> dict:
+async def generate_image(request: Request, prompt: str, width: int | None = None, height: int | None = None, tier: str | None = None, seed: int | None = None) -> Response:
     """Generate an image using local model.
     
     Args:
         prompt: Text prompt describing the image to generate
-        width: Image width (default: 512)
-        height: Image height (default: 512)
+        width: Image width, rounded to a multiple of 8 and capped by the tier (default: the tier's size)
+        height: Image height, same as width
+        tier: "preview", "standard" or "high" (default: IMAGE_DEFAULT_TIER)
+        seed: Noise seed from 0 to 2**63 - 1 (default: derived from the prompt), the same request always returns the same image
+        
+    Returns the PNG bytes as the response body with the seed in `X-Image-Seed`, errors
+    as a JSON body with a 400 (bad tier or seed) or 500 status. Repeated requests are answered
+    from the image cache. The generation is cancelled when the client disconnects before it is done.
     """
     print(f"[SERVER][GEN_LOCAL_IMAGE] Triggered")
     try:
-        # Generate the image
-        image = img_model(prompt).images[0]
-        
-        # Save image to file (optional, you can keep or remove this)
-        image.save("./result.png")
-        
-        # Convert image to bytes for the API response
-        buffered = BytesIO()
-        image.save(buffered, format="PNG")
-        img_bytes = buffered.getvalue()
-        
-        # Encode as base64 for JSON response
-        img_base64 = base64.b64encode(img_bytes).decode('utf-8')
+        settings = image_settings(tier, width, height)
+        seed = image_seed(prompt, seed)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"status": "error", "message": str(e)})
+    try:
+        # Generate the image as a job, batched with concurrent requests on the pipeline thread
+        job = submit_image_job(prompt, settings, seed)
+        while not job.finished:
+            await asyncio.wait({job.task}, timeout=1.0)
+            if not job.finished and await request.is_disconnected():
+                job.cancel()
+                print(f"[SERVER][GEN_LOCAL_IMAGE] Client went away, cancelled job {job.id}")
+                return Response(status_code=499)
+        if job.status != "done":
+            raise RuntimeError(job.error or job.status)
+        img_bytes = job.result
         
         print(f"[SERVER][GEN_LOCAL_IMAGE] Done")
-        return {
-            "status": "success",
-            "message": f"Generated image for prompt: {prompt}",
-            "image_bytes": img_base64
-        }
+        return Response(content=img_bytes, media_type="image/png", headers={"X-Image-Seed": str(seed)})
         
     except Exception as e:
         print(f"[SERVER][GEN_LOCAL_IMAGE] Error: {str(e)}")
-        return {
+        return JSONResponse(status_code=500, content={
             "status": "error",
-            "message": f"Error generating image: {str(e)}",
-            "image_bytes": None
-        }
+            "message": f"Error generating image: {str(e)}"
+        })
 
-@app.get("/image/describe")
-async def describe_image(prompt: str, file_byte: str) -> dict:
-    """Describe an uploaded image using DeepSeek-VL visual language model."""
+@app.post("/image/jobs", status_code=202)
+async def submit_image(prompt: str, width: int | None = None, height: int | None = None, tier: str | None = None, seed: int | None = None):
+    """Queue an image generation and return its job id right away.
+
+    Takes the same arguments as `GET /image/generate`. Follow it with
+    `GET /image/jobs/{job_id}` or the `/events` stream, fetch the PNG from
+    `/result` and cancel it with `DELETE /image/jobs/{job_id}`.
+    """
     try:
-        # Convert to base64
-        # image_base64 = base64.b64encode(bytes(file_byte)).decode('utf-8')
-        # mime_type = "image/jpeg"
-        # image = f"data:{mime_type};base64,{image_base64}"
-        
-        # Prepare conversation with image placeholder
-        conversation = [
-            {
-                "role": "User",
-                "content": f"<image_placeholder>Describe this image with the detail: {prompt}.",
-                "images": [file_byte]
-            },
-            {
-                "role": "Assistant",
-                "content": ""
-            }
-        ]
-        
-        # Load images and prepare inputs
-        pil_images = load_pil_images(conversation)
-        prepare_inputs = vl_chat_processor(
-            conversations=conversation,
-            images=pil_images,
-            force_batchify=True
-        ).to(vl_gpt.device)
-        print(f"[DESCRIBE_IMAGE] GOT IMAGE")
-        
+        settings = image_settings(tier, width, height)
+        seed = image_seed(prompt, seed)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"status": "error", "message": str(e)})
+    job = submit_image_job(prompt, settings, seed)
+    print(f"[SERVER][IMAGE_JOB] Submitted {job.id}")
+    return {**job.snapshot(), "seed": seed}
+
+def _find_job(job_id: str) -> Job | JSONResponse:
+    job = image_jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"status": "error", "message": f"Unknown job {job_id}"})
+    return job
+
+@app.get("/image/jobs/{job_id}")
+async def get_image_job(job_id: str):
+    job = _find_job(job_id)
+    return job.snapshot() if isinstance(job, Job) else job
+
+@app.get("/image/jobs/{job_id}/events")
+async def stream_image_job(job_id: str):
+    """Server-sent events with the job state on every step, until it finishes."""
+    job = _find_job(job_id)
+    if not isinstance(job, Job):
+        return job
+
+    async def events():
+        async for state in job.changes():
+            yield f"data: {json.dumps(state)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.get("/image/jobs/{job_id}/result")
+async def get_image_job_result(job_id: str):
+    job = _find_job(job_id)
+    if not isinstance(job, Job):
+        return job
+    if job.status != "done":
+        return JSONResponse(status_code=409, content=job.snapshot())
+    return Response(content=job.result, media_type="image/png")
+
+@app.delete("/image/jobs/{job_id}")
+async def cancel_image_job(job_id: str):
+    """Cancel a job; a running batch stops between steps once none of its jobs is wanted anymore."""
+    job = _find_job(job_id)
+    if not isinstance(job, Job):
+        return job
+    job.cancel()
+    print(f"[SERVER][IMAGE_JOB] Cancelled {job.id}")
+    return job.snapshot()
+
+def run_description(image: Image.Image, image_id: str, prompt: str) -> str:
+    """Describe a decoded image with DeepSeek-VL, runs on the vision thread."""
+    # Prepare conversation with image placeholder
+    conversation = [
+        {
+            "role": "User",
+            "content": f"<image_placeholder>Describe this image with the detail: {prompt}.",
+            "images": [image_id]
+        },
+        {
+            "role": "Assistant",
+            "content": ""
+        }
+    ]
+    
+    # The image is already decoded, nothing is loaded from disk
+    prepare_inputs = vl_chat_processor(
+        conversations=conversation,
+        images=[image],
+        force_batchify=True
+    ).to(vl_gpt.device, dtype=backend.dtype)
+    print(f"[DESCRIBE_IMAGE] GOT IMAGE")
+    
+    with backend.inference():
         # Run image encoder to get embeddings
         inputs_embeds = vl_gpt.prepare_inputs_embeds(**prepare_inputs)
-        
+
         # Generate response from model
         outputs = vl_gpt.language_model.generate(
             inputs_embeds=inputs_embeds,
@@ -122,8 +325,40 @@ async def describe_image(prompt: str, file_byte: str) -> dict:
             do_sample=False,
             use_cache=True
         )
+    
+    return tokenizer.decode(outputs[0].cpu().tolist(), skip_special_tokens=True)
+
+@app.post("/image/describe")
+async def describe_image(prompt: str, image_id: str, request: Request) -> dict:
+    """Describe an uploaded image using DeepSeek-VL visual language model.
+    
+    Args:
+        prompt: Detail requirement for the description
+        image_id: SHA-256 of the encoded image
         
-        answer = tokenizer.decode(outputs[0].cpu().tolist(), skip_special_tokens=True)
+    The request body carries the encoded image. It may be empty when the image was
+    sent before, a `missing_image` status asks the caller to send it again.
+    """
+    try:
+        body = await request.body()
+        if body:
+            image_id = image_digest(body)
+            image = decoded_images.get(image_id)
+            if image is None:
+                image = Image.open(BytesIO(body)).convert("RGB")
+                decoded_images.put(image_id, image)
+        else:
+            image = decoded_images.get(image_id)
+            if image is None:
+                return {
+                    "status": "missing_image",
+                    "message": "The image is not cached, send it in the request body."
+                }
+        
+        # The model runs on the vision thread, the event loop stays free for other requests
+        answer = await asyncio.get_running_loop().run_in_executor(
+            vision_executor, run_description, image, image_id, prompt
+        )
         print(f"[DESCRIBE_IMAGE] Done - Answer: {answer}")
         
         return {
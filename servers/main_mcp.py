@@ -6,17 +6,55 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import base64
-import requests
+import asyncio
+from typing import TypedDict
+from contextlib import asynccontextmanager
 from fastmcp import FastMCP, Context, Image
+from fastmcp.exceptions import ToolError
+from fastmcp.tools.tool import ToolResult
 
 from starlette.middleware import Middleware
 from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse
 from utils.logging_utils import logger
-from utils.utils import make_nws_request, format_alert, NWS_API_BASE
+from utils.utils import WeatherAnswer, fetch_nws, freshness_note, get_forecast_url, format_alert, format_alerts_compact, format_forecast_compact, continue_with, nws_cache, nws_breaker, points_cache, NWS_API_BASE
+from utils.single_flight import SingleFlight
+from utils.image_store import ImageStore, image_digest
+from utils.http_client import AsyncHttpPool
+from utils.metrics import BoundedConcurrency
+from utils.alerts_index import AlertIndex, AlertPoller
+from utils.gazetteer import Gazetteer
 
 IMAGE_GEN_URL = os.getenv("IMAGE_GEN_URL", "")
+# A diffusion run takes tens of seconds on CPU, the image service only handles a few at once
+IMAGE_GEN_TIMEOUT = float(os.getenv("IMAGE_GEN_TIMEOUT", "300"))
+# As many generations as the image service batches into one pipeline call, fewer would keep its batches small
+DIFFUSION_MAX_BATCH = int(os.getenv("DIFFUSION_MAX_BATCH", "4"))
+IMAGE_GEN_CONCURRENCY = int(os.getenv("IMAGE_GEN_CONCURRENCY", str(DIFFUSION_MAX_BATCH)))
+# Descriptions run on their own thread in the image service, they don't queue behind generations
+IMAGE_DESCRIBE_CONCURRENCY = int(os.getenv("IMAGE_DESCRIBE_CONCURRENCY", "1"))
+# Most locations/states a single batch tool call may ask for
+WEATHER_BATCH_MAX = int(os.getenv("WEATHER_BATCH_MAX", "10"))
+# "full" for the verbose text blocks, "compact" for size-capped tables; tools can override it per call
+WEATHER_OUTPUT_MODE = os.getenv("WEATHER_OUTPUT_MODE", "full").lower()
+# Worker processes behind the port; more than one needs stateless HTTP sessions
+MCP_WORKERS = int(os.getenv("MCP_WORKERS", "1"))
+MCP_STATELESS_HTTP = os.getenv("MCP_STATELESS_HTTP", "0") == "1" or MCP_WORKERS > 1
 
 mcp = FastMCP(name="MainMcpServer", host="0.0.0.0", port=5001)
+tool_flights = SingleFlight()
+# Pooled, non-blocking client to the image service; callers beyond its capacity queue here
+image_http = AsyncHttpPool(timeout=IMAGE_GEN_TIMEOUT, retries=0)
+image_service = BoundedConcurrency(IMAGE_GEN_CONCURRENCY)
+describe_service = BoundedConcurrency(IMAGE_DESCRIBE_CONCURRENCY)
+# Optional background index of every active alert, see ALERTS_POLL_INTERVAL
+alert_index = AlertIndex()
+alert_poller = AlertPoller(alert_index)
+# Offline place name lookup, so the model does not have to guess coordinates
+gazetteer = Gazetteer()
+# Uploaded images by content hash, so follow-up questions only need to send the hash
+uploaded_images = ImageStore()
 
 custom_middleware = [
     Middleware(
@@ -29,7 +67,10 @@ custom_middleware = [
 
 @mcp.tool(
     annotations={
-        "title": "Calculate multiplication"
+        "title": "Calculate multiplication",
+        "readOnlyHint": True,
+        "cacheTtl": 3600,
+        "directAnswer": "{first_number} multiplied by {second_number} is {result}."
     }
 )
 async def get_multiply(first_number: int, second_number: int, ctx: Context) -> dict:
@@ -43,65 +84,238 @@ async def get_multiply(first_number: int, second_number: int, ctx: Context) -> d
     
     return {
         "status": "ok",
-        "message": f"the mutiplication is {c}"
+        "message": f"the mutiplication is {c}",
+        "result": c
     }
     
 @mcp.tool(
     annotations={
-        "title": "Get weather alerts for US state from external API"
+        "title": "Get weather alerts for US state from external API",
+        "readOnlyHint": True,
+        "cacheTtl": 120
     }
 )
-async def get_alerts(state: str, ctx: Context) -> str:
+async def get_alerts(state: str, ctx: Context, compact: bool | None = None, cursor: int = 0) -> ToolResult:
     """Get weather alerts for a US state.
 
     Args:
         state: Two-letter US state code (e.g. CA, NY)
+        compact: One row per event, most severe first, instead of full descriptions
+        cursor: Row to continue from when a compact result said more are available
     """
-            
     logger.info(f"[SERVER][GET_ALERTS] Triggered")
+    answer = await _state_alerts(state.strip().upper(), _compact(compact), cursor)
+    logger.info(f"[SERVER][GET_ALERTS] Done")
+    return _weather_result(answer)
+
+@mcp.tool(
+    annotations={
+        "title": "Get weather alerts for several US states from external API",
+        "readOnlyHint": True,
+        "cacheTtl": 120
+    }
+)
+async def get_alerts_batch(states: list[str], ctx: Context, compact: bool | None = None) -> ToolResult:
+    """Get weather alerts for several US states in one call, e.g. to compare them.
+
+    Args:
+        states: Two-letter US state codes (e.g. ["CA", "NY"])
+        compact: One row per event, most severe first, instead of full descriptions
+    """
+    logger.info(f"[SERVER][GET_ALERTS_BATCH] Triggered")
+    unique_states = list(dict.fromkeys(state.strip().upper() for state in states))
+    unique_states, omitted = unique_states[:WEATHER_BATCH_MAX], unique_states[WEATHER_BATCH_MAX:]
+    answers = await asyncio.gather(*(_state_alerts(state, _compact(compact)) for state in unique_states))
+    logger.info(f"[SERVER][GET_ALERTS_BATCH] Done - {len(unique_states)} states, {len(omitted)} omitted")
+    # The batch tool has no cursor, more rows are fetched with the single-state tool
+    sections = [
+        f"Alerts for {state}:\n{continue_with(answer.text, f'get_alerts with state={state}')}"
+        for state, answer in zip(unique_states, answers)
+    ]
+    if omitted:
+        sections.append(_omitted_note(omitted))
+    return _weather_result(_merged(answers, "\n===\n".join(sections)))
+
+def _weather_result(answer: WeatherAnswer) -> ToolResult:
+    """Tool result of a weather answer: failures are tool errors and stale answers are flagged.
+
+    The client does not cache either, they must not outlive the NWS outage.
+    """
+    if answer.failed:
+        raise ToolError(answer.text)
+    return ToolResult(content=answer.text, structured_content={"result": answer.text, "degraded": answer.degraded})
+
+def _merged(answers: list[WeatherAnswer], text: str) -> WeatherAnswer:
+    """Answer of a batch: failed when every item failed, degraded when any item was stale or failed."""
+    return WeatherAnswer(
+        text,
+        degraded=any(answer.degraded or answer.failed for answer in answers),
+        failed=bool(answers) and all(answer.failed for answer in answers)
+    )
+
+def _omitted_note(omitted: list[str]) -> str:
+    return (
+        f"Not included, at most {WEATHER_BATCH_MAX} per call: {'; '.join(omitted)}. "
+        "Call the tool again for these."
+    )
+
+def _compact(compact: bool | None) -> bool:
+    return WEATHER_OUTPUT_MODE == "compact" if compact is None else compact
+
+async def _state_alerts(state: str, compact: bool = False, cursor: int = 0) -> WeatherAnswer:
+    if alert_poller.enabled:
+        if compact:
+            features = alert_index.state_features(state)
+            if features is not None:
+                return WeatherAnswer(format_alerts_compact(features, cursor) if features else "No active alerts for this state.")
+        else:
+            indexed = alert_index.alerts_text(state)
+            if indexed is not None:
+                return WeatherAnswer(indexed)
+    # Concurrent requests for the same state share one upstream fetch
+    return await tool_flights.do(
+        ("get_alerts", state, compact, cursor),
+        lambda: _alerts_text(state, compact, cursor)
+    )
+
+async def _alerts_text(state: str, compact: bool = False, cursor: int = 0) -> WeatherAnswer:
     url = f"{NWS_API_BASE}/alerts/active/area/{state}"
-    data = await make_nws_request(url)
+    result = await fetch_nws(url)
+    data = result.data if result else None
 
     if not data or "features" not in data:
-        return "Unable to fetch alerts or no alerts found."
+        return WeatherAnswer("Unable to fetch alerts or no alerts found.", failed=True)
 
     if not data["features"]:
-        return "No active alerts for this state."
-
-    alerts = [format_alert(feature) for feature in data["features"]]
-    
-    logger.info(f"[SERVER][GET_ALERTS] Done")
-    return "\n---\n".join(alerts)
+        text = "No active alerts for this state."
+    elif compact:
+        text = format_alerts_compact(data["features"], cursor)
+    else:
+        text = "\n---\n".join(format_alert(feature) for feature in data["features"])
+    return WeatherAnswer(text + freshness_note(result), degraded=result.degraded)
 
 @mcp.tool(
     annotations={
-        "title": "Get weather forecast for a location from external API"
+        "title": "Get weather forecast for a location from external API",
+        "readOnlyHint": True,
+        "cacheTtl": 900
     }
 )
-async def get_forecast(latitude: float, longtitude: float, ctx: Context) -> str:
-    """Get weather forecast for a location.
+async def get_forecast(
+    ctx: Context,
+    latitude: float | None = None,
+    longtitude: float | None = None,
+    place: str = "",
+    compact: bool | None = None,
+    cursor: int = 0
+) -> ToolResult:
+    """Get weather forecast for a location, given by its coordinates or by a US place name.
 
     Args:
         latitude: Latitude of the location
         longtitude: longtitude of the location
+        place: US city instead of coordinates (e.g. "Austin, TX")
+        compact: One short table row per period instead of detailed forecast blocks
+        cursor: Row to continue from when a compact result said more are available
     """
     logger.info(f"[SERVER][GET_FORECAST] Triggered")
-    # First get the forecast grid endpoint
-    points_url = f"{NWS_API_BASE}/points/{latitude},{longtitude}"
-    points_data = await make_nws_request(points_url)
+    location = _locate(latitude, longtitude, place)
+    if isinstance(location, str):
+        logger.info(f"[SERVER][GET_FORECAST] Failed: {location}")
+        return _weather_result(WeatherAnswer(location))
+    latitude, longtitude, label = location
+    answer = await _location_forecast(latitude, longtitude, _compact(compact), cursor)
+    logger.info(f"[SERVER][GET_FORECAST] Done")
+    if place:
+        answer = answer._replace(text=f"Forecast for {label}:\n{answer.text}")
+    return _weather_result(answer)
 
-    if not points_data:
-        return "Unable to fetch forecast data for this location."
+class Location(TypedDict, total=False):
+    latitude: float
+    longtitude: float
+    place: str
 
-    # Get the forecast URL from the points response
-    forecast_url = points_data["properties"]["forecast"]
-    forecast_data = await make_nws_request(forecast_url)
+def _locate(latitude: float | None, longtitude: float | None, place: str = "") -> tuple[float, float, str] | str:
+    """Coordinates and label of a forecast location, or the message to send back to the model."""
+    if place:
+        if place.strip().isdigit() and not gazetteer.has_zip_codes:
+            return f"ZIP codes are not supported, give the city of '{place}' or its latitude and longtitude."
+        found = gazetteer.lookup(place)
+        if found is None:
+            suggestions = gazetteer.suggestions(place)
+            hint = f" Did you mean {', '.join(suggestions)}?" if suggestions else ""
+            return f"Unknown place '{place}'.{hint} Otherwise give latitude and longtitude."
+        label = f"{found.name}, {found.state}" if found.state else found.name
+        return found.latitude, found.longtitude, f"{label} ({found.latitude}, {found.longtitude})"
+    if latitude is None or longtitude is None:
+        return "Give either a place or both latitude and longtitude."
+    return latitude, longtitude, f"{latitude}, {longtitude}"
+
+@mcp.tool(
+    annotations={
+        "title": "Get weather forecasts for several locations from external API",
+        "readOnlyHint": True,
+        "cacheTtl": 900
+    }
+)
+async def get_forecast_batch(locations: list[Location], ctx: Context, compact: bool | None = None) -> ToolResult:
+    """Get weather forecasts for several locations in one call, e.g. to compare them.
+
+    Args:
+        locations: Locations, each with a latitude and a longtitude or a US place name (e.g. {"place": "Austin, TX"})
+        compact: One short table row per period instead of detailed forecast blocks
+    """
+    logger.info(f"[SERVER][GET_FORECAST_BATCH] Triggered")
+    # Locations in the same forecast grid cell get the same forecast, fetch it once
+    unique_locations, errors = {}, []
+    for location in locations:
+        found = _locate(location.get("latitude"), location.get("longtitude"), location.get("place", ""))
+        if isinstance(found, str):
+            errors.append(found)
+            continue
+        latitude, longtitude, label = found
+        unique_locations.setdefault(points_cache.snap(latitude, longtitude), label)
+    unique_locations = list(unique_locations.items())
+    unique_locations, omitted = unique_locations[:WEATHER_BATCH_MAX], unique_locations[WEATHER_BATCH_MAX:]
+    if omitted:
+        errors.append(_omitted_note([label for _, label in omitted]))
+    answers = await asyncio.gather(*(
+        _location_forecast(latitude, longtitude, _compact(compact)) for (latitude, longtitude), _ in unique_locations
+    ))
+    logger.info(f"[SERVER][GET_FORECAST_BATCH] Done - {len(unique_locations)} locations, {len(omitted)} omitted")
+    # The batch tool has no cursor, more rows are fetched with the single-location tool
+    text = "\n===\n".join([
+        f"Forecast for {label}:\n"
+        f"{continue_with(answer.text, f'get_forecast with latitude={latitude}, longtitude={longtitude}')}"
+        for ((latitude, longtitude), label), answer in zip(unique_locations, answers)
+    ] + errors)
+    return _weather_result(_merged(answers, text))
+
+async def _location_forecast(latitude: float, longtitude: float, compact: bool = False, cursor: int = 0) -> WeatherAnswer:
+    # Concurrent requests for the same location share one upstream fetch
+    return await tool_flights.do(
+        ("get_forecast", latitude, longtitude, compact, cursor),
+        lambda: _forecast_text(latitude, longtitude, compact, cursor)
+    )
+
+async def _forecast_text(latitude: float, longtitude: float, compact: bool = False, cursor: int = 0) -> WeatherAnswer:
+    # First get the forecast grid endpoint, usually already known for this area
+    forecast_url = await get_forecast_url(latitude, longtitude)
+
+    if not forecast_url:
+        return WeatherAnswer("Unable to fetch forecast data for this location.", failed=True)
+
+    result = await fetch_nws(forecast_url)
+    forecast_data = result.data if result else None
 
     if not forecast_data:
-        return "Unable to fetch detailed forecast."
+        return WeatherAnswer("Unable to fetch detailed forecast.", failed=True)
 
     # Format the periods into a readable forecast
     periods = forecast_data["properties"]["periods"]
+    if compact:
+        return WeatherAnswer(format_forecast_compact(periods, cursor) + freshness_note(result), degraded=result.degraded)
+
     forecasts = []
     for period in periods[:5]:  # Only show next 5 periods
         forecast = f"""
@@ -112,43 +326,51 @@ Forecast: {period['detailedForecast']}
 """
         forecasts.append(forecast)
 
-    logger.info(f"[SERVER][GET_FORECAST] Done")
-    return "\n---\n".join(forecasts)
+    return WeatherAnswer("\n---\n".join(forecasts) + freshness_note(result), degraded=result.degraded)
 
 @mcp.tool(
     annotations={
-        "title": "Generate image from a locally deploy Image Diffusion/Denoising model."
+        "title": "Generate image from a locally deploy Image Diffusion/Denoising model.",
+        "directAnswer": "Here is the generated image for: {prompt}",
+        "idempotentHint": False
     }
 )
-async def generate_image(prompt: str, ctx: Context, width: int = 512, height: int = 512) -> Image | None | dict:
-    """Call request to image generator API
+async def generate_image(prompt: str, ctx: Context, width: int | None = None, height: int | None = None, tier: str = "", seed: int | None = None) -> Image | None | dict:
+    """Generate an image from a text prompt with the locally hosted diffusion model.
     
     Args:
         prompt: Text prompt describing the image to generate
-        width: Image width (default: 512)
-        height: Image height (default: 512)
+        width: Image width, rounded to a multiple of 8 and capped by the tier. Leave empty for the tier's size.
+        height: Image height, same as width
+        tier: "preview" (fast, up to 512px), "standard" or "high" (slow, best quality). Leave empty for the server default.
+        seed: Noise seed, only to get a different variant of the same prompt (default: derived from the prompt)
     """
     logger.info(f"[SERVER][GEN_LOCAL_IMAGE] Triggered")
     try:
-        params = {
-            "prompt": prompt,
-            "width": width,
-            "height": height
-        }
-        response = requests.get(f"{IMAGE_GEN_URL}/image/generate", params=params)
+        # Only what the caller gave, the image service picks the tier's defaults for the rest
+        params = {"prompt": prompt}
+        if width:
+            params["width"] = width
+        if height:
+            params["height"] = height
+        if tier:
+            params["tier"] = tier
+        if seed is not None:
+            params["seed"] = seed
+        async with image_service.slot() as waited:
+            logger.info(f"[SERVER][GEN_LOCAL_IMAGE] Waited {waited:.2f}s for the image service")
+            response = await image_http.get(f"{IMAGE_GEN_URL}/image/generate", params=params)
         # First check if the request was successful (HTTP 200)
-        if response.status_code == 200:
+        if response.status_code == 200 and response.headers.get("content-type", "").startswith("image/"):
+            # Raw PNG body, wrapped as MCP image content without decoding it
+            logger.info(f"[SERVER][GEN_LOCAL_IMAGE] Got image of {len(response.content)} bytes")
+            logger.info(f"[SERVER][GEN_LOCAL_IMAGE] Done")
+            return Image(data=response.content, format="png").to_image_content()
+        elif response.status_code in (200, 400, 500):
             try:
                 data = response.json()  # Use response.json() instead of json.loads(response.content)
-                
-                if data["status"] == "success":                    
-                    logger.info(f"[SERVER][GEN_LOCAL_IMAGE] Got reponse {data['message']}")
-                    logger.info(f"[SERVER][GEN_LOCAL_IMAGE] Done")
-                    image = Image(data=base64.b64decode(data["image_bytes"]), format="png")
-                    return image.to_image_content()
-                else:
-                    logger.info(f"[SERVER][GEN_LOCAL_IMAGE] Failed: {data}")
-                    return data
+                logger.info(f"[SERVER][GEN_LOCAL_IMAGE] Failed: {data}")
+                return data
                 
             except ValueError:
                 logger.info(f"[SERVER][GEN_LOCAL_IMAGE] Failed: Invalid JSON response")
@@ -164,7 +386,7 @@ async def generate_image(prompt: str, ctx: Context, width: int = 512, height: in
             }
         
     except Exception as e:
-        logger.info(f"[SERVER][GEN_LOCAL_IMAGE] Done")
+        logger.info(f"[SERVER][GEN_LOCAL_IMAGE] Failed: {e}")
         return {
             "status": "failed",
             "message": "Failed to generate image"
@@ -173,22 +395,54 @@ async def generate_image(prompt: str, ctx: Context, width: int = 512, height: in
 
 @mcp.tool(
     annotations={
-        "title": "Generate an image description from the uploaded image."
-    }
+        "title": "Generate an image description from the uploaded image.",
+        "idempotentHint": False
+    },
+    # Filled in by the client from the upload, not by the LLM
+    exclude_args=["image_id", "image_data"]
 )
-async def describe_image(prompt: str, ctx: Context) -> dict:
-    """Call request to image generator API
+async def describe_image(prompt: str, ctx: Context, image_id: str = "", image_data: str = "") -> dict:
+    """Describe the image uploaded by the user.
     
     Args:
         prompt: Text prompt about the detail requirement for the image description.
+        image_id: SHA-256 of the encoded image, enough on its own once the image was sent
+        image_data: Base64 encoded image, only needed the first time an image is sent
     """
     logger.info(f"[SERVER][DESCRIBE_IMAGE] Triggered")
+    image_bytes = None
+    if image_data:
+        image_bytes = base64.b64decode(image_data)
+        image_id = image_digest(image_bytes)
+        uploaded_images.put(image_id, image_bytes)
+    elif image_id not in uploaded_images:
+        logger.info(f"[SERVER][DESCRIBE_IMAGE] Unknown image {image_id}, asking the client to send it")
+        return {
+            "status": "missing_image",
+            "message": "The image is not available on the server, send image_data."
+        }
+    
     try:
         params = {
             "prompt": prompt,
-            "file_byte": "../input.jpg"
+            "image_id": image_id
         }
-        response = requests.get(f"{IMAGE_GEN_URL}/image/describe", params=params)
+        # The model server usually still holds the decoded image, only send the bytes when it does not
+        async with describe_service.slot() as waited:
+            logger.info(f"[SERVER][DESCRIBE_IMAGE] Waited {waited:.2f}s for the image service")
+            response = await image_http.post(
+                f"{IMAGE_GEN_URL}/image/describe",
+                params=params,
+                content=image_bytes,
+                headers={"Content-Type": "image/jpeg"} if image_bytes else None
+            )
+            if response.status_code == 200 and image_bytes is None and response.json().get("status") == "missing_image":
+                response = await image_http.post(
+                    f"{IMAGE_GEN_URL}/image/describe",
+                    params=params,
+                    content=uploaded_images.get(image_id),
+                    headers={"Content-Type": "image/jpeg"}
+                )
         # First check if the request was successful (HTTP 200)
         if response.status_code == 200:
             try:
@@ -216,11 +470,47 @@ async def describe_image(prompt: str, ctx: Context) -> dict:
             }
         
     except Exception as e:
-        logger.info(f"[SERVER][DESCRIBE_IMAGE] Done")
+        logger.info(f"[SERVER][DESCRIBE_IMAGE] Failed: {e}")
         return {
             "status": "failed",
             "message": "Failed to generate image"
         }
 
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics(request: Request) -> JSONResponse:
+    return JSONResponse({
+        "pid": os.getpid(),
+        "image_service": image_service.snapshot(),
+        "describe_service": describe_service.snapshot(),
+        "tool_calls_in_flight": len(tool_flights),
+        "nws_cache": nws_cache.stats(),
+        "nws_breaker": nws_breaker.snapshot(),
+        "alerts_index": alert_poller.snapshot(),
+    })
+
+def create_app():
+    """Streamable HTTP app of the server, with the background tasks tied to its lifespan."""
+    app = mcp.http_app(stateless_http=MCP_STATELESS_HTTP)
+    mcp_lifespan = app.router.lifespan_context
+
+    @asynccontextmanager
+    async def lifespan(app):
+        # Compiling a large GAZETTEER_PATH dataset takes a while, do it before the first request
+        await asyncio.to_thread(gazetteer.load)
+        async with alert_poller.running():
+            async with mcp_lifespan(app):
+                yield
+
+    app.router.lifespan_context = lifespan
+    return app
+
 if __name__ == "__main__":
-    mcp.run(transport='http')
\ No newline at end of file
+    import uvicorn
+
+    if MCP_WORKERS > 1:
+        # Workers inherit the environment, so they all pick up the same shared cache file
+        os.environ.setdefault("SHARED_CACHE_PATH", "mcp_shared_cache.sqlite3")
+        logger.info(f"[SERVER] Starting {MCP_WORKERS} stateless workers, shared cache {os.environ['SHARED_CACHE_PATH']}")
+        uvicorn.run("servers.main_mcp:create_app", factory=True, host="0.0.0.0", port=5001, workers=MCP_WORKERS)
+    else:
+        uvicorn.run(create_app(), host="0.0.0.0", port=5001)
\ No newline at end of file
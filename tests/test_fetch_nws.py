@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from utils import utils
+from utils.circuit_breaker import CircuitBreaker
+from utils.nws_cache import HttpCache
+from utils.single_flight import SingleFlight
+from utils.utils import NWS_STALE_IF_ERROR, NWS_STALE_WHILE_REVALIDATE, fetch_nws, freshness_note
+
+URL = "https://api.weather.gov/alerts/active/area/TX"
+
+
+class FakeNws:
+    def __init__(self):
+        self.status = 200
+        self.error = None
+        self.calls = 0
+
+    async def get(self, url, headers=None, retry=True):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return httpx.Response(
+            self.status,
+            json={"features": ["new"]},
+            headers={"cache-control": "max-age=60"},
+            request=httpx.Request("GET", url),
+        )
+
+
+@pytest.fixture
+def nws(monkeypatch):
+    fake = FakeNws()
+    monkeypatch.setattr(utils, "nws_http", fake)
+    monkeypatch.setattr(utils, "nws_cache", HttpCache())
+    monkeypatch.setattr(utils, "nws_breaker", CircuitBreaker("nws", failure_threshold=2, reset_timeout=30))
+    monkeypatch.setattr(utils, "nws_flights", SingleFlight())
+    return fake
+
+
+def cache_stale(seconds):
+    """Put an entry in the cache that expired `seconds` ago."""
+    entry = utils.nws_cache.store(URL, {"features": ["old"]}, {"cache-control": "max-age=60"})
+    entry.expires_at = time.time() - seconds
+    entry.fetched_at = entry.expires_at - 60
+    return entry
+
+
+async def fetch_and_settle():
+    result = await fetch_nws(URL)
+    # Let a background refresh run
+    for _ in range(3):
+        await asyncio.sleep(0)
+    return result
+
+
+def test_fresh_entry_is_served_without_a_request(nws):
+    assert asyncio.run(fetch_nws(URL)).data == {"features": ["new"]}
+    result = asyncio.run(fetch_nws(URL))
+    assert result.data == {"features": ["new"]} and not result.degraded
+    assert nws.calls == 1
+    assert freshness_note(result) == ""
+
+
+def test_stale_while_revalidate_serves_the_copy_and_refreshes(nws):
+    cache_stale(NWS_STALE_WHILE_REVALIDATE / 2)
+    result = asyncio.run(fetch_and_settle())
+    assert result.data == {"features": ["old"]} and not result.degraded
+    assert nws.calls == 1
+    assert asyncio.run(utils.nws_cache.get(URL)).body == {"features": ["new"]}
+
+
+def test_stale_if_error_serves_a_degraded_copy(nws):
+    cache_stale(NWS_STALE_WHILE_REVALIDATE + 60)
+    nws.status = 503
+    result = asyncio.run(fetch_and_settle())
+    assert result.data == {"features": ["old"]} and result.degraded
+    assert utils.nws_cache.stale_served == 1
+    assert "last updated 3 minutes ago" in freshness_note(result)
+
+
+def test_copy_past_stale_if_error_is_not_served(nws):
+    cache_stale(NWS_STALE_IF_ERROR + 60)
+    nws.error = httpx.ConnectError("down")
+    assert asyncio.run(fetch_and_settle()) is None
+
+
+def test_open_breaker_skips_nws_and_falls_back_to_the_copy(nws):
+    nws.error = httpx.ConnectError("down")
+    for _ in range(2):
+        assert asyncio.run(fetch_nws(URL)) is None
+    assert utils.nws_breaker.state == "open"
+    cache_stale(NWS_STALE_WHILE_REVALIDATE + 60)
+    result = asyncio.run(fetch_nws(URL))
+    assert result.degraded
+    assert nws.calls == 2
+
+
+def test_client_errors_do_not_trip_the_breaker(nws):
+    nws.status = 404
+    for _ in range(3):
+        assert asyncio.run(fetch_nws(URL)) is None
+    assert utils.nws_breaker.state == "closed"
@@ -0,0 +1,27 @@
+import pytest
+
+from utils.gazetteer import Gazetteer
+
+
+@pytest.fixture(scope="module")
+def gazetteer(tmp_path_factory):
+    return Gazetteer(index_dir=str(tmp_path_factory.mktemp("gazetteer")))
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("Austin, TX", ("Austin", "TX")),
+    ("portland oregon", ("Portland", "OR")),
+    ("New York City", ("New York", "NY")),
+    ("NYC", ("New York", "NY")),
+    ("Washington DC", ("Washington", "DC")),
+    ("Oklahoma City", ("Oklahoma City", "OK")),
+    ("Saint Louis", ("St. Louis", "MO")),
+])
+def test_lookup(gazetteer, query, expected):
+    place = gazetteer.lookup(query)
+    assert (place.name, place.state) == expected
+
+
+def test_bundled_list_has_no_zip_codes(gazetteer):
+    assert not gazetteer.has_zip_codes
+    assert gazetteer.lookup("10001") is None
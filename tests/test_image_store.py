@@ -0,0 +1,20 @@
+from utils.image_store import ImageStore
+
+
+def test_evicts_least_recently_used_by_payload_size():
+    store = ImageStore(max_bytes=1000, sizeof=lambda entry: len(entry[1]))
+    for i in range(100):
+        store.put(f"key{i}", (f"digest{i}", b"x" * 1000))
+    assert len(store) == 1
+    assert "key99" in store
+    assert store.total_bytes == 1000
+
+
+def test_get_refreshes_recency():
+    store = ImageStore(max_bytes=2000, sizeof=lambda entry: len(entry[1]))
+    store.put("a", ("da", b"x" * 1000))
+    store.put("b", ("db", b"x" * 1000))
+    store.get("a")
+    store.put("c", ("dc", b"x" * 1000))
+    assert "a" in store and "c" in store
+    assert "b" not in store
@@ -0,0 +1,55 @@
+import asyncio
+
+from utils.jobs import JobRegistry
+
+
+def test_changes_ends_with_the_final_state_of_a_fast_job():
+    async def main():
+        registry = JobRegistry()
+
+        async def cached(job):
+            return b"png"
+
+        job = registry.submit({}, cached)
+        states = []
+        async for state in job.changes():
+            states.append(state["status"])
+            await asyncio.sleep(0)  # the job finishes while this snapshot is consumed
+        return states, job.status
+
+    states, status = asyncio.run(main())
+    assert status == "done"
+    assert states[0] == "queued"
+    assert states[-1] == "done"
+
+
+def test_changes_reports_progress_and_failure():
+    async def main():
+        registry = JobRegistry()
+
+        async def failing(job):
+            job.report(1, 2)
+            await asyncio.sleep(0.01)
+            raise RuntimeError("boom")
+
+        job = registry.submit({}, failing)
+        return [state async for state in job.changes()]
+
+    states = asyncio.run(main())
+    assert [state["status"] for state in states] == ["queued", "running", "failed"]
+    assert states[-1]["error"] == "boom"
+
+
+def test_cancelled_job_reports_cancelled():
+    async def main():
+        registry = JobRegistry()
+
+        async def slow(job):
+            await asyncio.sleep(10)
+
+        job = registry.submit({}, slow)
+        await asyncio.sleep(0)
+        job.cancel()
+        return [state["status"] async for state in job.changes()]
+
+    assert asyncio.run(main())[-1] == "cancelled"
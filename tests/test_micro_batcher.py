@@ -0,0 +1,94 @@
+import asyncio
+import threading
+
+from utils.micro_batcher import MicroBatcher
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def recording_batcher(calls, max_batch_size=4, max_wait=0.05, gate=None):
+    def run_batch(key, items):
+        if gate is not None:
+            gate.wait(1)
+        calls.append((key, list(items)))
+        return [f"{key}:{item}" for item in items]
+
+    return MicroBatcher(run_batch, max_batch_size=max_batch_size, max_wait=max_wait)
+
+
+def test_requests_within_the_window_share_a_batch():
+    calls = []
+
+    async def main():
+        batcher = recording_batcher(calls)
+        return await asyncio.gather(*(batcher.submit("k", i) for i in range(3)))
+
+    assert run(main()) == ["k:0", "k:1", "k:2"]
+    assert calls == [("k", [0, 1, 2])]
+
+
+def test_different_keys_run_as_separate_batches():
+    calls = []
+
+    async def main():
+        batcher = recording_batcher(calls)
+        return await asyncio.gather(batcher.submit("a", 1), batcher.submit("b", 2), batcher.submit("a", 3))
+
+    assert run(main()) == ["a:1", "b:2", "a:3"]
+    assert sorted(calls) == [("a", [1, 3]), ("b", [2])]
+
+
+def test_full_batches_are_split_at_max_batch_size():
+    calls = []
+
+    async def main():
+        batcher = recording_batcher(calls, max_batch_size=2, max_wait=10)
+        results = await asyncio.gather(*(batcher.submit("k", i) for i in range(5)))
+        return results, batcher.snapshot()
+
+    results, snapshot = run(main())
+    assert results == [f"k:{i}" for i in range(5)]
+    assert [len(items) for _, items in calls] == [2, 2, 1]
+    assert snapshot["largest_batch"] == 2
+
+
+def test_cancelled_callers_are_dropped_before_their_batch_runs():
+    calls = []
+    gate = threading.Event()
+
+    async def main():
+        batcher = recording_batcher(calls, max_batch_size=1, gate=gate)
+        first = asyncio.ensure_future(batcher.submit("k", "first"))
+        await asyncio.sleep(0.1)  # "first" is running, the next ones queue behind it
+        dropped = asyncio.ensure_future(batcher.submit("k", "dropped"))
+        kept = asyncio.ensure_future(batcher.submit("k", "kept"))
+        await asyncio.sleep(0.1)
+        dropped.cancel()
+        gate.set()
+        return await first, await kept
+
+    assert run(main()) == ("k:first", "k:kept")
+    assert [items for _, items in calls] == [["first"], ["kept"]]
+
+
+def test_short_result_list_fails_the_remaining_callers():
+    async def main():
+        batcher = MicroBatcher(lambda key, items: items[:1], max_batch_size=2, max_wait=0.01)
+        return await asyncio.gather(batcher.submit("k", 1), batcher.submit("k", 2), return_exceptions=True)
+
+    first, second = run(main())
+    assert first == 1
+    assert isinstance(second, RuntimeError)
+
+
+def test_batch_errors_reach_every_caller():
+    def run_batch(key, items):
+        raise ValueError("boom")
+
+    async def main():
+        batcher = MicroBatcher(run_batch, max_wait=0.01)
+        return await asyncio.gather(batcher.submit("k", 1), batcher.submit("k", 2), return_exceptions=True)
+
+    assert all(isinstance(result, ValueError) for result in run(main()))
@@ -0,0 +1,50 @@
+import asyncio
+import time
+from email.utils import formatdate
+
+import pytest
+
+from utils.nws_cache import HttpCache, freshness_lifetime
+
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"cache-control": "no-store, max-age=300"}, None),
+    ({"cache-control": "no-cache"}, 0.0),
+    ({"cache-control": "public, max-age=300"}, 300.0),
+    ({"cache-control": "max-age=300", "age": "100"}, 200.0),
+    ({"cache-control": "max-age=300", "age": "400"}, 0.0),
+    ({"cache-control": "s-maxage=60, max-age=300"}, 60.0),
+    ({"cache-control": 'max-age="120"'}, 120.0),
+    ({}, 0.0),
+])
+def test_freshness_lifetime_from_cache_control(headers, expected):
+    assert freshness_lifetime(headers) == expected
+
+
+def test_freshness_lifetime_from_expires_relative_to_date():
+    now = time.time()
+    headers = {"date": formatdate(now, usegmt=True), "expires": formatdate(now + 600, usegmt=True), "age": "60"}
+    assert freshness_lifetime(headers) == pytest.approx(540, abs=1)
+
+
+def test_max_age_wins_over_expires_and_bad_dates_are_ignored():
+    assert freshness_lifetime({"cache-control": "max-age=30", "expires": formatdate(time.time() + 600, usegmt=True)}) == 30.0
+    assert freshness_lifetime({"expires": "0"}) == 0.0
+
+
+def test_stored_entries_are_served_until_they_expire():
+    cache = HttpCache()
+    entry = cache.store("u", {"a": 1}, {"cache-control": "max-age=60", "etag": '"v1"'})
+    cached = asyncio.run(cache.get("u"))
+    assert cached is entry and cached.fresh()
+    assert cached.conditional_headers() == {"If-None-Match": '"v1"'}
+    cached.expires_at = time.time() - 5
+    assert not cached.fresh()
+    assert cached.staleness() == pytest.approx(5, abs=1)
+
+
+def test_no_store_responses_are_not_kept():
+    cache = HttpCache()
+    cache.store("u", {"a": 1}, {"cache-control": "max-age=60"})
+    cache.store("u", {"a": 2}, {"cache-control": "no-store"})
+    assert asyncio.run(cache.get("u")) is None
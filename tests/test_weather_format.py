@@ -0,0 +1,12 @@
+from utils.utils import continue_with, paginate_rows
+
+
+def test_paginated_hint_asks_for_compact_mode():
+    text = paginate_rows("Header", [f"row {i}" for i in range(30)])
+    assert text.endswith("(20 more available, call again with compact=true and cursor=10)")
+    assert paginate_rows("Header", [f"row {i}" for i in range(30)], cursor=10).splitlines()[1] == "row 10"
+
+
+def test_batch_hint_names_the_single_item_call():
+    text = continue_with(paginate_rows("Header", [f"row {i}" for i in range(30)]), "get_alerts with state=TX")
+    assert text.endswith("(20 more available, call get_alerts with state=TX, compact=true and cursor=10)")
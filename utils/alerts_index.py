@@ -0,0 +1,202 @@
+import os
+import time
+import asyncio
+from contextlib import asynccontextmanager, suppress
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from .logging_utils import logger
+from .metrics import LatencyStats
+from .utils import fetch_nws, format_alert, NWS_API_BASE
+from .shared_cache import FileLock, SharedCache, shared_cache
+
+# Seconds between polls of the national active-alerts feed, 0 disables the poller
+ALERTS_POLL_INTERVAL = float(os.getenv("ALERTS_POLL_INTERVAL", "0"))
+# The index is only trusted while it is younger than this, get_alerts falls back to a live request otherwise
+ALERTS_INDEX_MAX_AGE = float(os.getenv("ALERTS_INDEX_MAX_AGE", str(3 * ALERTS_POLL_INTERVAL)))
+ALERTS_FEED_URL = f"{NWS_API_BASE}/alerts/active"
+
+NO_ALERTS_TEXT = "No active alerts for this state."
+
+
+class AlertIndex:
+    """Active alerts indexed by state, UGC zone and severity, with the text already formatted.
+
+    States are taken from the UGC codes of an alert (`CAZ006` and `CAC001` both
+    belong to CA), the same codes the `/alerts/active/area/{state}` endpoint filters on.
+    """
+
+    def __init__(self):
+        self.texts: Dict[str, str] = {}
+        self.features: Dict[str, Dict[str, Any]] = {}
+        self.by_state: Dict[str, List[str]] = {}
+        self.by_zone: Dict[str, List[str]] = {}
+        self.by_severity: Dict[str, List[str]] = {}
+        self.state_texts: Dict[str, str] = {}
+        self.refreshed_at: Optional[float] = None
+
+    def rebuild(self, features: List[Dict[str, Any]]):
+        texts, by_state, by_zone, by_severity, by_id = {}, {}, {}, {}, {}
+        for feature in features:
+            props = feature.get("properties", {})
+            alert_id = props.get("id") or feature.get("id")
+            if not alert_id or alert_id in texts:
+                continue
+            texts[alert_id] = format_alert(feature)
+            by_id[alert_id] = feature
+            zones = props.get("geocode", {}).get("UGC", [])
+            for zone in zones:
+                by_zone.setdefault(zone, []).append(alert_id)
+            for state in dict.fromkeys(zone[:2] for zone in zones):
+                by_state.setdefault(state, []).append(alert_id)
+            by_severity.setdefault(props.get("severity", "Unknown"), []).append(alert_id)
+
+        self.texts, self.by_state, self.by_zone, self.by_severity = texts, by_state, by_zone, by_severity
+        self.features = by_id
+        self.state_texts = {
+            state: "\n---\n".join(texts[alert_id] for alert_id in alert_ids)
+            for state, alert_ids in by_state.items()
+        }
+
+    def age(self) -> Optional[float]:
+        return None if self.refreshed_at is None else time.time() - self.refreshed_at
+
+    def usable(self, max_age: float = ALERTS_INDEX_MAX_AGE) -> bool:
+        age = self.age()
+        return age is not None and age <= max_age
+
+    def alerts_text(self, state: str, max_age: float = ALERTS_INDEX_MAX_AGE) -> Optional[str]:
+        """Formatted alerts of a state, `None` when the index is missing or too old to answer."""
+        if not self.usable(max_age):
+            return None
+        return self.state_texts.get(state, NO_ALERTS_TEXT)
+
+    def state_features(self, state: str, max_age: float = ALERTS_INDEX_MAX_AGE) -> Optional[List[Dict[str, Any]]]:
+        """Raw alert features of a state, `None` when the index is missing or too old to answer."""
+        if not self.usable(max_age):
+            return None
+        return [self.features[alert_id] for alert_id in self.by_state.get(state, [])]
+
+    def snapshot(self) -> Dict[str, Any]:
+        age = self.age()
+        return {
+            "alerts": len(self.texts),
+            "states": len(self.by_state),
+            "zones": len(self.by_zone),
+            "by_severity": {severity: len(alert_ids) for severity, alert_ids in self.by_severity.items()},
+            "age_s": None if age is None else round(age, 1),
+        }
+
+
+class AlertPoller:
+    """Keeps an `AlertIndex` up to date by polling the national active-alerts feed.
+
+    Requests go through `fetch_nws`, so an unchanged feed is answered from the
+    response cache or with a `304` and the index is not rebuilt. A stale copy
+    served because NWS is failing does not count as a refresh.
+
+    With a `shared` store several worker processes run a poller each, but only the
+    one holding the poller file lock talks to NWS and publishes the feed; the
+    others rebuild their index from what it published. If the leader dies the OS
+    releases the lock and another worker takes over on its next tick.
+    """
+
+    def __init__(
+        self,
+        index: AlertIndex,
+        interval: float = ALERTS_POLL_INTERVAL,
+        url: str = ALERTS_FEED_URL,
+        shared: Optional[SharedCache] = shared_cache,
+    ):
+        self.index = index
+        self.interval = interval
+        self.url = url
+        self.shared = shared
+        self.lock = FileLock(f"{shared.path}.alerts.lock") if shared is not None else None
+        self.refresh_duration = LatencyStats()
+        self.failures = 0
+        self._last_data = None
+        self._shared_version: Optional[float] = None
+
+    @property
+    def role(self) -> str:
+        if self.lock is None:
+            return "single"
+        return "leader" if self.lock.held else "follower"
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    async def refresh(self) -> bool:
+        started = time.perf_counter()
+        result = await fetch_nws(self.url)
+        data = result.data if result is not None and not result.degraded else None
+        if not data or "features" not in data:
+            self.failures += 1
+            logger.info(f"[ALERTS] Failed to refresh the active alerts index")
+            return False
+        if data is not self._last_data:
+            self.index.rebuild(data["features"])
+            self._last_data = data
+            if self.shared is not None:
+                await asyncio.to_thread(self.shared.set, "alerts", "features", data["features"])
+        self.index.refreshed_at = time.time()
+        if self.shared is not None:
+            await asyncio.to_thread(self.shared.set, "alerts", "refreshed_at", self.index.refreshed_at)
+        self.refresh_duration.observe(time.perf_counter() - started)
+        logger.info(f"[ALERTS] Index refreshed, {len(self.index.texts)} active alerts")
+        return True
+
+    async def sync(self) -> bool:
+        """Load the index published by the leading worker, if it changed since the last sync."""
+        # The store is shared with the other workers, a locked database must not stall the event loop
+        refreshed = await asyncio.to_thread(self.shared.get, "alerts", "refreshed_at")
+        version = await asyncio.to_thread(self.shared.updated_at, "alerts", "features")
+        if refreshed is None or version is None:
+            return False
+        if version != self._shared_version:
+            row = await asyncio.to_thread(self.shared.get, "alerts", "features")
+            if row is None:
+                return False
+            self.index.rebuild(row[0])
+            self._shared_version = row[1]
+        self.index.refreshed_at = refreshed[0]
+        return True
+
+    async def _run(self):
+        while True:
+            try:
+                if self.lock is None or self.lock.try_acquire():
+                    await self.refresh()
+                else:
+                    await self.sync()
+            except Exception as e:
+                self.failures += 1
+                logger.info(f"[ALERTS] Refresh failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    @asynccontextmanager
+    async def running(self) -> AsyncIterator[None]:
+        """Poll in the background for the duration of the block when enabled."""
+        if not self.enabled:
+            yield
+            return
+        task = asyncio.create_task(self._run())
+        try:
+            yield
+        finally:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+            if self.lock is not None:
+                self.lock.release()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "role": self.role,
+            "interval_s": self.interval,
+            "failures": self.failures,
+            "refresh_duration": self.refresh_duration.snapshot(),
+            "index": self.index.snapshot(),
+        }
@@ -0,0 +1,183 @@
+import os
+import json
+from typing import Any, Dict, List, Optional
+
+from openai import AsyncOpenAI
+
+from .logging_utils import logger
+from .conversation_store import Conversation
+
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "6000"))
+CONTEXT_KEEP_RECENT_TURNS = int(os.getenv("CONTEXT_KEEP_RECENT_TURNS", "3"))
+CONTEXT_TOOL_STUB_CHARS = int(os.getenv("CONTEXT_TOOL_STUB_CHARS", "160"))
+CONTEXT_CHARS_PER_TOKEN = float(os.getenv("CONTEXT_CHARS_PER_TOKEN", "4"))
+CONTEXT_SUMMARIZE = os.getenv("CONTEXT_SUMMARIZE", "0") == "1"
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "256"))
+# Compaction aims below the budget so the compacted prefix stays unchanged for the next turns
+CONTEXT_TARGET_RATIO = float(os.getenv("CONTEXT_TARGET_RATIO", "0.75"))
+
+# Chat template overhead per message (role header and end-of-turn tokens)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = """
+Summarize the following conversation between a user and an assistant in a few sentences.
+Keep every fact the assistant may need later: places, coordinates, dates, numbers and tool results.
+"""
+
+
+def estimate_tokens(message: Dict[str, Any], chars_per_token: float = CONTEXT_CHARS_PER_TOKEN) -> int:
+    """Cheap token estimate of one chat message, no tokenizer round trip needed."""
+    chars = len(str(message.get("content") or ""))
+    for tool_call in message.get("tool_calls") or []:
+        chars += len(json.dumps(tool_call.get("function", {}), ensure_ascii=False))
+    return int(chars / chars_per_token) + MESSAGE_OVERHEAD_TOKENS
+
+
+def split_turns(messages: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Group messages into turns, each starting at a user message.
+
+    An assistant tool call and its tool results always end up in the same turn,
+    so dropping whole turns never leaves an orphan tool message behind.
+    """
+    turns = []
+    for message in messages:
+        if message["role"] == "user" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def collapse_tool_result(message: Dict[str, Any], stub_chars: int = CONTEXT_TOOL_STUB_CHARS) -> Dict[str, Any]:
+    content = str(message.get("content") or "")
+    if message["role"] != "tool" or len(content) <= stub_chars:
+        return message
+    stub = " ".join(content.split())[:stub_chars]
+    return {**message, "content": f"[Earlier {message.get('tool_name', 'tool')} result, truncated] {stub}..."}
+
+
+def truncate_tool_result(message: Dict[str, Any], max_chars: int) -> Dict[str, Any]:
+    """Cut a recent tool result to `max_chars`, keeping its layout so tables stay readable."""
+    content = str(message.get("content") or "")
+    if message["role"] != "tool" or len(content) <= max_chars:
+        return message
+    note = f"\n[{message.get('tool_name', 'tool')} result truncated, {{}} more characters]"
+    kept = max(0, max_chars - len(note) - 8)
+    return {**message, "content": content[:kept] + note.format(len(content) - kept)}
+
+
+class ContextManager:
+    """Fits a conversation into a token budget before it is sent to the LLM.
+
+    Under budget the messages are returned unchanged. Over budget, in this order:
+    old tool results are collapsed into short stubs, older turns are optionally
+    replaced by an LLM summary cached on the conversation, and finally the oldest
+    turns are dropped. The system prompt and the most recent turns stay verbatim,
+    except for tool results that alone would not fit, which are cut to the budget
+    that is left.
+
+    The compacted messages are frozen on the conversation and later turns only
+    append to them, until the budget is exceeded again. This keeps the prompt
+    prefix byte-stable so the LLM server can reuse its prompt cache.
+    """
+
+    def __init__(
+        self,
+        llm: Optional[AsyncOpenAI] = None,
+        model_name: Optional[str] = None,
+        max_tokens: int = CONTEXT_MAX_TOKENS,
+        keep_recent_turns: int = CONTEXT_KEEP_RECENT_TURNS,
+        summarize: bool = CONTEXT_SUMMARIZE,
+    ):
+        self.llm = llm
+        self.model_name = model_name
+        self.max_tokens = max_tokens
+        self.target_tokens = int(max_tokens * CONTEXT_TARGET_RATIO)
+        self.keep_recent_turns = max(1, keep_recent_turns)
+        self.summarize = summarize and llm is not None
+
+    def count_tokens(self, messages: List[Dict[str, Any]]) -> int:
+        return sum(estimate_tokens(message) for message in messages)
+
+    async def prepare(self, conversation: Conversation) -> List[Dict[str, Any]]:
+        messages = conversation.messages
+        if conversation.compacted_prefix is not None:
+            view = conversation.compacted_prefix + messages[conversation.compacted_upto:]
+        else:
+            view = messages
+        if self.count_tokens(view) <= self.max_tokens:
+            return list(view)
+
+        budget = self.target_tokens
+        system, turns = messages[0], split_turns(messages[1:])
+        old_turns, recent_turns = turns[:-self.keep_recent_turns], turns[-self.keep_recent_turns:]
+        old_turns = [[collapse_tool_result(message) for message in turn] for turn in old_turns]
+
+        if self.summarize and old_turns and self._size(system, old_turns, recent_turns) > budget:
+            summary = await self._summary(conversation, covered=1 + sum(len(turn) for turn in old_turns))
+            if summary:
+                system = {**system, "content": f"{system['content']}\nSummary of the earlier conversation:\n{summary}\n"}
+                old_turns = []
+
+        # Still too large: drop whole turns from the front, the latest turn is always kept
+        while old_turns and self._size(system, old_turns, recent_turns) > budget:
+            old_turns.pop(0)
+        while len(recent_turns) > 1 and self._size(system, old_turns, recent_turns) > budget:
+            recent_turns.pop(0)
+        # The latest turn alone can still be too large, e.g. a full get_alerts for a busy state
+        if self._size(system, old_turns, recent_turns) > budget:
+            recent_turns = self._fit_tool_results(system, old_turns, recent_turns, budget)
+
+        compacted = [system] + [message for turn in old_turns + recent_turns for message in turn]
+        conversation.compacted_prefix = compacted
+        conversation.compacted_upto = len(messages)
+        logger.info(f"[CONTEXT] Compacted {len(messages)} messages to {len(compacted)} (~{self.count_tokens(compacted)} tokens)")
+        return compacted
+
+    def _size(self, system: Dict[str, Any], old_turns: List[List[Dict]], recent_turns: List[List[Dict]]) -> int:
+        return estimate_tokens(system) + sum(self.count_tokens(turn) for turn in old_turns + recent_turns)
+
+    def _fit_tool_results(
+        self,
+        system: Dict[str, Any],
+        old_turns: List[List[Dict]],
+        recent_turns: List[List[Dict]],
+        budget: int
+    ) -> List[List[Dict]]:
+        """Share what is left of the budget evenly between the tool results of the kept turns."""
+        tool_messages = [message for turn in recent_turns for message in turn if message["role"] == "tool"]
+        if not tool_messages:
+            return recent_turns
+        other_tokens = self._size(system, old_turns, recent_turns) - self.count_tokens(tool_messages)
+        tokens_per_result = (budget - other_tokens) // len(tool_messages) - MESSAGE_OVERHEAD_TOKENS
+        max_chars = max(CONTEXT_TOOL_STUB_CHARS, int(tokens_per_result * CONTEXT_CHARS_PER_TOKEN))
+        return [[truncate_tool_result(message, max_chars) for message in turn] for turn in recent_turns]
+
+    async def _summary(self, conversation: Conversation, covered: int) -> Optional[str]:
+        """Summary of `conversation.messages[1:covered]`, extended incrementally and cached per session."""
+        if covered <= conversation.summary_upto:
+            return conversation.summary
+
+        new_messages = conversation.messages[max(1, conversation.summary_upto):covered]
+        transcript = "\n".join(
+            f"{message['role']}: {collapse_tool_result(message)['content']}"
+            for message in new_messages if message.get("content")
+        )
+        if conversation.summary:
+            transcript = f"Previous summary: {conversation.summary}\n{transcript}"
+        try:
+            response = await self.llm.chat.completions.create(
+                model=self.model_name,
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": transcript},
+                ],
+                max_tokens=CONTEXT_SUMMARY_MAX_TOKENS,
+                temperature=0,
+            )
+        except Exception as e:
+            logger.info(f"[CONTEXT] Summarization failed, dropping old turns instead: {e}")
+            return None
+
+        conversation.summary = (response.choices[0].message.content or "").strip()
+        conversation.summary_upto = covered
+        return conversation.summary
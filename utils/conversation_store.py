@@ -0,0 +1,122 @@
+import os
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Union
+
+from gradio.components.chatbot import ChatMessage
+
+CONVERSATION_MAX_SESSIONS = int(os.getenv("CONVERSATION_MAX_SESSIONS", "256"))
+CONVERSATION_IDLE_TTL = float(os.getenv("CONVERSATION_IDLE_TTL", "3600"))
+
+LLM_ROLES = ("user", "assistant", "system")
+
+
+def _message_fingerprint(role: str, content: Any) -> str:
+    return hashlib.sha1(f"{role}\x00{content}".encode("utf-8", "replace")).hexdigest()
+
+
+class Conversation:
+    """LLM-side message list of a single chat session.
+
+    `messages` is what is sent to the model; `history_fingerprints` remembers which
+    Gradio history entries were already merged so each turn only appends new ones.
+    """
+
+    def __init__(self, system_prompt: str, session_id: Optional[str] = None):
+        self.system_prompt = system_prompt
+        self.session_id = session_id
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+        self.reset()
+
+    def reset(self):
+        self.messages: List[Dict[str, Any]] = [{"role": "system", "content": self.system_prompt}]
+        self.history_fingerprints: List[str] = []
+        # Cached summary of messages[1:summary_upto], maintained by the context manager
+        self.summary: Optional[str] = None
+        self.summary_upto = 0
+        # Frozen compacted form of messages[:compacted_upto], see ContextManager.prepare
+        self.compacted_prefix: Optional[List[Dict[str, Any]]] = None
+        self.compacted_upto = 0
+
+    def sync_history(self, history: List[Union[Dict[str, Any], ChatMessage]]) -> int:
+        """Append the history entries that were not seen yet and return how many were added.
+
+        Gradio sends the whole chat on every turn. Entries are matched by position and
+        fingerprint: the shared prefix is skipped, and if the prefix does not match
+        (the chat was cleared or edited) the conversation starts over.
+        """
+        fingerprints = []
+        entries = []
+        for msg in history:
+            if isinstance(msg, ChatMessage):
+                role, content, metadata = msg.role, msg.content, msg.metadata
+            else:
+                role, content, metadata = msg.get("role"), msg.get("content"), msg.get("metadata")
+            fingerprints.append(_message_fingerprint(role, content))
+            entries.append((role, content, metadata))
+
+        seen = len(self.history_fingerprints)
+        if seen > len(fingerprints) or fingerprints[:seen] != self.history_fingerprints:
+            self.reset()
+            seen = 0
+
+        added = 0
+        for role, content, metadata in entries[seen:]:
+            # Tool progress bubbles and uploaded files are UI-only, the model already
+            # received the tool calls and results as structured messages.
+            if role not in LLM_ROLES or metadata or not isinstance(content, str):
+                continue
+            self.messages.append({"role": role, "content": content})
+            added += 1
+        self.history_fingerprints = fingerprints
+        self.last_used = time.monotonic()
+        return added
+
+
+class ConversationStore:
+    """Session-keyed conversations with LRU eviction of idle sessions."""
+
+    def __init__(
+        self,
+        system_prompt: str,
+        max_sessions: int = CONVERSATION_MAX_SESSIONS,
+        idle_ttl: float = CONVERSATION_IDLE_TTL,
+    ):
+        self.system_prompt = system_prompt
+        self.max_sessions = max(1, max_sessions)
+        self.idle_ttl = idle_ttl
+        self._sessions: "OrderedDict[str, Conversation]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, session_id: Optional[str]) -> Conversation:
+        key = session_id or "default"
+        self._evict_idle()
+        conversation = self._sessions.get(key)
+        if conversation is None:
+            conversation = Conversation(self.system_prompt, session_id=key)
+            self._sessions[key] = conversation
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(key)
+        conversation.last_used = time.monotonic()
+        return conversation
+
+    def drop(self, session_id: Optional[str]):
+        self._sessions.pop(session_id or "default", None)
+
+    def _evict_idle(self):
+        if self.idle_ttl <= 0:
+            return
+        deadline = time.monotonic() - self.idle_ttl
+        # Least recently used sessions sit at the front
+        while self._sessions:
+            key, conversation = next(iter(self._sessions.items()))
+            if conversation.last_used >= deadline or conversation.lock.locked():
+                break
+            self._sessions.popitem(last=False)
@@ -0,0 +1,262 @@
+import os
+import re
+import csv
+import mmap
+import bisect
+import struct
+import difflib
+import hashlib
+import tempfile
+import threading
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from .logging_utils import logger
+
+BUNDLED_GAZETTEER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "us_cities.csv")
+# Optional larger dataset, e.g. the Census Gazetteer place and ZCTA (ZIP) files
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", "")
+GAZETTEER_INDEX_DIR = os.getenv("GAZETTEER_INDEX_DIR", tempfile.gettempdir())
+
+INDEX_MAGIC = b"GAZ1"
+HEADER = struct.Struct("<4sI")
+ENTRY = struct.Struct("<ffI")  # latitude, longtitude, rank
+
+STATE_NAMES = {
+    "alabama": "al", "alaska": "ak", "arizona": "az", "arkansas": "ar", "california": "ca",
+    "colorado": "co", "connecticut": "ct", "delaware": "de", "district of columbia": "dc",
+    "florida": "fl", "georgia": "ga", "hawaii": "hi", "idaho": "id", "illinois": "il",
+    "indiana": "in", "iowa": "ia", "kansas": "ks", "kentucky": "ky", "louisiana": "la",
+    "maine": "me", "maryland": "md", "massachusetts": "ma", "michigan": "mi", "minnesota": "mn",
+    "mississippi": "ms", "missouri": "mo", "montana": "mt", "nebraska": "ne", "nevada": "nv",
+    "new hampshire": "nh", "new jersey": "nj", "new mexico": "nm", "new york": "ny",
+    "north carolina": "nc", "north dakota": "nd", "ohio": "oh", "oklahoma": "ok", "oregon": "or",
+    "pennsylvania": "pa", "puerto rico": "pr", "rhode island": "ri", "south carolina": "sc",
+    "south dakota": "sd", "tennessee": "tn", "texas": "tx", "utah": "ut", "vermont": "vt",
+    "virginia": "va", "washington": "wa", "west virginia": "wv", "wisconsin": "wi", "wyoming": "wy",
+}
+STATE_CODES = set(STATE_NAMES.values())
+# Common names and nicknames the fuzzy match can't bridge, as (normalized name, state)
+ALIASES = {
+    "nyc": ("new york", "ny"),
+    "new york city": ("new york", "ny"),
+    "manhattan": ("new york", "ny"),
+    "la": ("los angeles", "ca"),
+    "sf": ("san francisco", "ca"),
+    "san fran": ("san francisco", "ca"),
+    "philly": ("philadelphia", "pa"),
+    "vegas": ("las vegas", "nv"),
+    "nola": ("new orleans", "la"),
+    "dc": ("washington", "dc"),
+    "washington dc": ("washington", "dc"),
+}
+# Census place names carry their legal type as a suffix
+PLACE_SUFFIX = re.compile(r"\s+(city|town|village|borough|cdp|municipality)$")
+
+
+class Place(NamedTuple):
+    name: str
+    state: str
+    latitude: float
+    longtitude: float
+
+
+def normalize_name(name: str) -> str:
+    """Lowercase name without punctuation and with the usual abbreviations spelled one way."""
+    name = name.lower().replace(".", "").replace("'", "")
+    name = re.sub(r"[^a-z0-9, ]+", " ", name)
+    name = re.sub(r"\bsaint\b", "st", name)
+    name = re.sub(r"\bft\b", "fort", name)
+    name = re.sub(r"\bmt\b", "mount", name)
+    return " ".join(name.split())
+
+
+def parse_query(query: str) -> Tuple[str, str]:
+    """Split "Portland, OR", "portland oregon" or "97201" into a normalized name and state code."""
+    text = normalize_name(query)
+    text = re.sub(r"[, ]+(usa|us|united states)$", "", text)
+    if "," in text:
+        name, _, state = text.rpartition(",")
+        state = state.strip()
+        state = STATE_NAMES.get(state, state)
+        if state in STATE_CODES:
+            return " ".join(name.replace(",", " ").split()), state
+        return " ".join(text.replace(",", " ").split()), ""
+    tokens = text.split()
+    # A trailing state only counts when something is left for the name ("new york" is a city too)
+    for size in (2, 1):
+        if len(tokens) > size:
+            tail = " ".join(tokens[-size:])
+            state = STATE_NAMES.get(tail, tail if size == 1 else "")
+            if state in STATE_CODES:
+                return " ".join(tokens[:-size]), state
+    return text, ""
+
+
+def read_places(path: str) -> Iterator[Tuple[str, str, float, float]]:
+    """Rows of (display name, state, latitude, longtitude) from a gazetteer file.
+
+    Accepts the bundled `name,state,latitude,longitude` CSV as well as the
+    tab-separated Census Gazetteer files (`NAME`/`USPS`/`INTPTLAT`/`INTPTLONG`, and
+    `GEOID` as the name of ZCTA rows, so ZIP codes can be looked up directly).
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        dialect = "excel-tab" if "\t" in f.readline() else "excel"
+        f.seek(0)
+        for row in csv.DictReader(f, dialect=dialect):
+            row = {key.strip().lower(): (value or "").strip() for key, value in row.items() if key}
+            name = row.get("name") or row.get("geoid")
+            latitude = row.get("latitude") or row.get("intptlat")
+            longtitude = row.get("longitude") or row.get("longtitude") or row.get("intptlong")
+            if not name or not latitude or not longtitude:
+                continue
+            yield PLACE_SUFFIX.sub("", name), (row.get("state") or row.get("usps") or "").upper(), float(latitude), float(longtitude)
+
+
+def compile_index(source: str, index_path: str) -> int:
+    """Compile a gazetteer file into the sorted binary index read by `Gazetteer`.
+
+    Layout: header, `count + 1` offsets into the string blob, one fixed-size
+    (latitude, longtitude, rank) entry per place, then the blob of
+    `"<normalized name>|<state>\\0<display name>"` records sorted by key. The rank is
+    the row order of the source, which lists bigger places first.
+    """
+    records: Dict[str, Tuple[int, str, float, float]] = {}
+    for rank, (name, state, latitude, longtitude) in enumerate(read_places(source)):
+        key = f"{normalize_name(name)}|{state.lower()}"
+        if key not in records:
+            records[key] = (rank, f"{name}, {state}" if state else name, latitude, longtitude)
+
+    keys = sorted(records)
+    blob, offsets, entries = bytearray(), [], bytearray()
+    for key in keys:
+        rank, display, latitude, longtitude = records[key]
+        offsets.append(len(blob))
+        blob += f"{key}\0{display}".encode("utf-8")
+        entries += ENTRY.pack(latitude, longtitude, rank)
+    offsets.append(len(blob))
+
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(INDEX_MAGIC, len(keys)))
+        f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        f.write(entries)
+        f.write(blob)
+    os.replace(tmp_path, index_path)
+    return len(keys)
+
+
+class _Keys:
+    """Sequence view of the sorted keys for `bisect`, read straight from the index."""
+
+    def __init__(self, gazetteer: "Gazetteer"):
+        self.gazetteer = gazetteer
+
+    def __len__(self) -> int:
+        return self.gazetteer.count
+
+    def __getitem__(self, i: int) -> str:
+        return self.gazetteer._record(i)[0]
+
+
+class Gazetteer:
+    """Offline place name → coordinates lookup over a memory-mapped sorted index.
+
+    The source file is compiled once into `GAZETTEER_INDEX_DIR` (keyed by its
+    path, size and mtime) and then memory-mapped, so large datasets cost no heap
+    and lookups are binary searches: exact name, then name prefix, then a fuzzy
+    match (difflib) among names sharing the first letter.
+    """
+
+    def __init__(self, source: str = GAZETTEER_PATH or BUNDLED_GAZETTEER, index_dir: str = GAZETTEER_INDEX_DIR):
+        self.source = source
+        self.index_dir = index_dir
+        self.count = 0
+        self._mmap: Optional[mmap.mmap] = None
+        self._offsets_at = 0
+        self._entries_at = 0
+        self._blob_at = 0
+        self._keys = _Keys(self)
+        self._lock = threading.Lock()
+
+    def _index_path(self) -> str:
+        stat = os.stat(self.source)
+        digest = hashlib.sha1(f"{os.path.abspath(self.source)}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+        return os.path.join(self.index_dir, f"gazetteer-{digest[:16]}.idx")
+
+    def load(self):
+        with self._lock:
+            if self._mmap is not None:
+                return
+            index_path = self._index_path()
+            if not os.path.exists(index_path):
+                count = compile_index(self.source, index_path)
+                logger.info(f"[GAZETTEER] Compiled {count} places from {self.source}")
+            with open(index_path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self.count = HEADER.unpack_from(self._mmap, 0)
+            if magic != INDEX_MAGIC:
+                raise ValueError(f"{index_path} is not a gazetteer index")
+            self._offsets_at = HEADER.size
+            self._entries_at = self._offsets_at + 4 * (self.count + 1)
+            self._blob_at = self._entries_at + ENTRY.size * self.count
+
+    def _record(self, i: int) -> Tuple[str, str]:
+        start, end = struct.unpack_from("<II", self._mmap, self._offsets_at + 4 * i)
+        key, _, display = self._mmap[self._blob_at + start:self._blob_at + end].decode("utf-8").partition("\0")
+        return key, display
+
+    def _entry(self, i: int) -> Tuple[float, float, int]:
+        return ENTRY.unpack_from(self._mmap, self._entries_at + ENTRY.size * i)
+
+    def _range(self, prefix: str) -> range:
+        lo = bisect.bisect_left(self._keys, prefix)
+        hi = bisect.bisect_left(self._keys, prefix + "\uffff", lo)
+        return range(lo, hi)
+
+    def _place(self, i: int) -> Place:
+        key, display = self._record(i)
+        latitude, longtitude, _ = self._entry(i)
+        state = key.rsplit("|", 1)[1].upper()
+        name = display[:-len(state) - 2] if state else display
+        return Place(name, state, round(latitude, 4), round(longtitude, 4))
+
+    def _best(self, candidates: range, state: str) -> Optional[int]:
+        matches = [i for i in candidates if not state or self._keys[i].endswith(f"|{state}")]
+        return min(matches, key=lambda i: self._entry(i)[2]) if matches else None
+
+    @property
+    def has_zip_codes(self) -> bool:
+        """Whether the dataset has ZIP code rows (a ZCTA file), digits sort before any name."""
+        self.load()
+        return self.count > 0 and self._keys[0][:1].isdigit()
+
+    def lookup(self, query: str) -> Optional[Place]:
+        self.load()
+        name, state = parse_query(query)
+        if not name or not self.count:
+            return None
+        alias, alias_state = ALIASES.get(name, (name, state))
+        if not state or state == alias_state:
+            name, state = alias, alias_state
+        best = self._best(self._range(f"{name}|"), state)
+        if best is None:
+            best = self._best(self._range(name), state)
+        if best is None and name.endswith(" city"):
+            # Real names like "Oklahoma City" matched above, here "Boston City" means Boston
+            best = self._best(self._range(f"{name[:-5]}|"), state)
+        if best is None:
+            names = list(dict.fromkeys(self._keys[i].split("|", 1)[0] for i in self._range(name[0])))
+            for close in difflib.get_close_matches(name, names, n=3, cutoff=0.8):
+                best = self._best(self._range(f"{close}|"), state)
+                if best is not None:
+                    break
+        return self._place(best) if best is not None else None
+
+    def suggestions(self, query: str, n: int = 3) -> List[str]:
+        """Display names close to an unknown query, to tell the model what it may have meant."""
+        self.load()
+        name, _ = parse_query(query)
+        if not name or not self.count:
+            return []
+        names = {self._keys[i].split("|", 1)[0]: i for i in self._range(name[0])}
+        return [self._record(names[close])[1] for close in difflib.get_close_matches(name, list(names), n=n, cutoff=0.6)]
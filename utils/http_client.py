@@ -0,0 +1,111 @@
+import os
+import random
+import asyncio
+from typing import Dict, Optional
+
+import httpx
+
+from .logging_utils import logger
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_PER_HOST_CONCURRENCY = int(os.getenv("HTTP_PER_HOST_CONCURRENCY", "16"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.25"))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "2"))
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class AsyncHttpPool:
+    """Shared async HTTP client with keep-alive, per-host limits and retries.
+
+    The underlying `httpx.AsyncClient` is created lazily in the running event loop
+    and reused by every request, so connections (HTTP/2 when `h2` is installed) stay
+    open between tool calls. Retries use exponential backoff with full jitter and
+    only apply to transport errors and retryable status codes.
+    """
+
+    def __init__(
+        self,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: float = 10.0,
+        max_connections: int = HTTP_MAX_CONNECTIONS,
+        max_keepalive: int = HTTP_MAX_KEEPALIVE,
+        per_host_concurrency: int = HTTP_PER_HOST_CONCURRENCY,
+        retries: int = HTTP_RETRIES,
+        base_url: str = "",
+    ):
+        self.headers = headers or {}
+        self.timeout = timeout
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+        self.per_host_concurrency = max(1, per_host_concurrency)
+        self.retries = max(0, retries)
+        self.base_url = base_url
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=http2_available(),
+            )
+            self._loop = loop
+            self._host_limits = {}
+        return self._client
+
+    def _host_limit(self, url: httpx.URL) -> asyncio.Semaphore:
+        semaphore = self._host_limits.get(url.host)
+        if semaphore is None:
+            semaphore = self._host_limits[url.host] = asyncio.Semaphore(self.per_host_concurrency)
+        return semaphore
+
+    def _backoff(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), HTTP_BACKOFF_MAX)
+        return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
+
+    async def request(self, method: str, url: str, retry: bool = True, **kwargs) -> httpx.Response:
+        client = self.client
+        limit = self._host_limit(client.build_request(method, url).url)
+        attempts = self.retries + 1 if retry else 1
+        for attempt in range(attempts):
+            response = None
+            try:
+                async with limit:
+                    response = await client.request(method, url, **kwargs)
+                if response.status_code not in RETRY_STATUS_CODES or attempt == attempts - 1:
+                    return response
+                logger.info(f"[HTTP] {method} {url} returned {response.status_code}, retrying")
+            except httpx.TransportError as e:
+                if attempt == attempts - 1:
+                    raise
+                logger.info(f"[HTTP] {method} {url} failed ({e.__class__.__name__}), retrying")
+            await asyncio.sleep(self._backoff(attempt, response))
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def aclose(self):
+        if self._client is not None and self._loop is asyncio.get_running_loop():
+            await self._client.aclose()
+        self._client = None
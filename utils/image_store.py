@@ -0,0 +1,76 @@
+import os
+import hashlib
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+
+IMAGE_STORE_MAX_BYTES = int(os.getenv("IMAGE_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+def image_digest(data: bytes) -> str:
+    """Content address of an encoded image."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class ImageStore:
+    """In-memory LRU keyed by content hash, bounded by the total size of its values.
+
+    Used on every tier of the image hand-off: encoded uploads in the app, raw bytes
+    in the MCP server and decoded images in the model server, so a follow-up
+    question about the same upload neither re-sends nor re-decodes it.
+    """
+
+    def __init__(self, max_bytes: int = IMAGE_STORE_MAX_BYTES, sizeof: Optional[Callable[[Any], int]] = None):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or len
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, Tuple[Any, int]]" = OrderedDict()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: str, value: Any):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        size = self.sizeof(value)
+        self._entries[key] = (value, size)
+        self.total_bytes += size
+        # Keep at least the newest entry even when it alone exceeds the budget
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.total_bytes -= evicted_size
+
+
+class LazyImage:
+    """Encoded image bytes that are only decoded when something needs the pixels.
+
+    The generated image travels from the tool result to the UI as the bytes the
+    model server encoded; `to_pil` decodes them once, at render time.
+    """
+
+    def __init__(self, data: bytes, mime_type: str = "image/png"):
+        self.data = data
+        self.mime_type = mime_type
+        self._pil = None
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def to_pil(self):
+        if self._pil is None:
+            from io import BytesIO
+            from PIL import Image
+
+            self._pil = Image.open(BytesIO(self.data))
+            self._pil.load()
+        return self._pil
@@ -0,0 +1,126 @@
+import os
+from typing import Optional
+
+import torch
+
+from .logging_utils import logger
+
+# auto picks cuda, then mps, then cpu
+INFERENCE_DEVICE = os.getenv("INFERENCE_DEVICE", "auto")
+# 0 keeps torch's default (one intra-op thread per physical core)
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", "0"))
+TORCH_NUM_INTEROP_THREADS = int(os.getenv("TORCH_NUM_INTEROP_THREADS", "0"))
+# auto: float16 on cuda, bfloat16 on cpus with native bf16 support, float32 otherwise
+INFERENCE_DTYPE = os.getenv("INFERENCE_DTYPE", "auto")
+# "int8" applies dynamic int8 quantization to the Linear layers when running on cpu
+INFERENCE_QUANTIZE = os.getenv("INFERENCE_QUANTIZE", "none")
+INFERENCE_CHANNELS_LAST = os.getenv("INFERENCE_CHANNELS_LAST", "1") == "1"
+INFERENCE_COMPILE = os.getenv("INFERENCE_COMPILE", "0") == "1"
+
+DTYPES = {"float32": torch.float32, "bfloat16": torch.bfloat16, "float16": torch.float16}
+
+
+def resolve_device(device: str = INFERENCE_DEVICE) -> str:
+    if device != "auto":
+        return device
+    if torch.cuda.is_available():
+        return "cuda"
+    if torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def cpu_bf16_supported() -> bool:
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+class InferenceBackend:
+    """Device, precision and CPU tuning shared by the image and vision models.
+
+    `configure` must run before the first model is loaded, torch only accepts the
+    inter-op thread count before any parallel work started. Models are prepared
+    with `prepare_diffusion` / `prepare_model` and called inside `inference()`,
+    which has to be entered on the thread that runs the model.
+    """
+
+    def __init__(
+        self,
+        device: str = INFERENCE_DEVICE,
+        dtype: str = INFERENCE_DTYPE,
+        quantize: str = INFERENCE_QUANTIZE,
+        channels_last: bool = INFERENCE_CHANNELS_LAST,
+        compile: bool = INFERENCE_COMPILE,
+    ):
+        self.device = resolve_device(device)
+        # Dynamic quantization only exists for cpu and needs float32 weights
+        self.quantize = quantize == "int8" and self.device == "cpu"
+        self.dtype = self._resolve_dtype(dtype)
+        self.channels_last = channels_last
+        self.compile = compile
+
+    def _resolve_dtype(self, dtype: str) -> torch.dtype:
+        if self.quantize:
+            if dtype not in ("auto", "float32"):
+                logger.info(f"[INFERENCE] INFERENCE_DTYPE={dtype} ignored, int8 quantization runs in float32")
+            return torch.float32
+        if dtype != "auto":
+            return DTYPES[dtype]
+        if self.device == "cuda":
+            return torch.float16
+        if self.device == "cpu" and cpu_bf16_supported():
+            return torch.bfloat16
+        return torch.float32
+
+    def configure(self, num_threads: int = TORCH_NUM_THREADS, num_interop_threads: int = TORCH_NUM_INTEROP_THREADS):
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
+        if num_interop_threads > 0:
+            try:
+                torch.set_num_interop_threads(num_interop_threads)
+            except RuntimeError as e:
+                logger.info(f"[INFERENCE] Inter-op threads already fixed: {e}")
+        logger.info(
+            f"[INFERENCE] device={self.device} dtype={self.dtype} int8={self.quantize} "
+            f"channels_last={self.channels_last} compile={self.compile} threads={torch.get_num_threads()}"
+        )
+
+    def _quantized(self, module: torch.nn.Module) -> torch.nn.Module:
+        return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def prepare_diffusion(self, pipe):
+        pipe = pipe.to(self.device, self.dtype)
+        if self.channels_last:
+            pipe.unet.to(memory_format=torch.channels_last)
+            pipe.vae.to(memory_format=torch.channels_last)
+        if self.quantize:
+            pipe.unet = self._quantized(pipe.unet)
+            pipe.text_encoder = self._quantized(pipe.text_encoder)
+        if self.compile:
+            pipe.unet = torch.compile(pipe.unet)
+        return pipe
+
+    def prepare_model(self, model: torch.nn.Module, compile: Optional[bool] = None) -> torch.nn.Module:
+        """Move a model to the backend, the vision LLM is not compiled by default (generate recompiles)."""
+        model = model.to(self.device, self.dtype).eval()
+        if self.quantize:
+            model = self._quantized(model)
+        if compile:
+            model = torch.compile(model)
+        return model
+
+    def inference(self):
+        return torch.inference_mode()
+
+    def snapshot(self) -> dict:
+        return {
+            "device": self.device,
+            "dtype": str(self.dtype).replace("torch.", ""),
+            "int8": self.quantize,
+            "channels_last": self.channels_last,
+            "compile": self.compile,
+            "threads": torch.get_num_threads(),
+            "interop_threads": torch.get_num_interop_threads(),
+        }
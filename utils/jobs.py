@@ -0,0 +1,124 @@
+import os
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+# Finished jobs (and their results) are kept this long for status and result requests
+JOB_TTL = float(os.getenv("JOB_TTL", "600"))
+JOB_MAX_FINISHED = int(os.getenv("JOB_MAX_FINISHED", "256"))
+
+
+class Job:
+    """A unit of background work with progress, a result and cooperative cancellation.
+
+    Progress is reported from the worker thread through `report`, which hands the
+    update over to the event loop, so listeners of `changes` only ever run there.
+    `cancel_requested` is what the worker checks between steps.
+    """
+
+    def __init__(self, payload: Dict[str, Any]):
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        self.status = "queued"
+        self.step = 0
+        self.total_steps: Optional[int] = None
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.cancel_requested = False
+        self.task: Optional[asyncio.Task] = None
+        self.version = 0
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    def _set(self, **fields):
+        if self.finished:
+            return
+        for name, value in fields.items():
+            setattr(self, name, value)
+        if self.finished:
+            self.finished_at = time.time()
+        self.version += 1
+        self._changed.set()
+
+    def report(self, step: int, total_steps: Optional[int] = None):
+        """Thread-safe progress update from the worker, the first one marks the job as running."""
+        self._loop.call_soon_threadsafe(
+            lambda: self._set(status="running", step=step, total_steps=total_steps or self.total_steps)
+        )
+
+    def cancel(self) -> bool:
+        if self.finished:
+            return False
+        self.cancel_requested = True
+        if self.task is not None:
+            self.task.cancel()
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "step": self.step,
+            "total_steps": self.total_steps,
+            "progress": round(self.step / self.total_steps, 3) if self.total_steps else 0.0,
+            "error": self.error,
+        }
+
+    async def changes(self) -> AsyncIterator[Dict[str, Any]]:
+        """Snapshots of the job each time it changes, ending with its final state."""
+        version = -1
+        while True:
+            if self.version != version:
+                version = self.version
+                yield self.snapshot()
+            # The job may have finished while the last snapshot was being consumed
+            if self.finished and self.version == version:
+                return
+            if self.version != version:
+                continue
+            self._changed.clear()
+            await self._changed.wait()
+
+
+class JobRegistry:
+    """Starts jobs as tasks on the event loop and keeps them around for a while after they finish."""
+
+    def __init__(self, ttl: float = JOB_TTL, max_finished: int = JOB_MAX_FINISHED):
+        self.ttl = ttl
+        self.max_finished = max_finished
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+
+    def submit(self, payload: Dict[str, Any], run: Callable[[Job], Awaitable[Any]]) -> Job:
+        self._prune()
+        job = Job(payload)
+        job.task = asyncio.create_task(self._run(job, run))
+        self._jobs[job.id] = job
+        return job
+
+    async def _run(self, job: Job, run: Callable[[Job], Awaitable[Any]]):
+        try:
+            result = await run(job)
+        except asyncio.CancelledError:
+            job._set(status="cancelled")
+        except Exception as e:
+            job._set(status="failed", error=str(e))
+        else:
+            job._set(status="done", result=result)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def _prune(self):
+        now = time.time()
+        finished = [job for job in self._jobs.values() if job.finished]
+        for i, job in enumerate(finished):
+            if now - job.finished_at > self.ttl or len(finished) - i > self.max_finished:
+                del self._jobs[job.id]
@@ -0,0 +1,51 @@
+import os
+from collections import OrderedDict
+from typing import Dict, Optional
+
+LLM_PROMPT_CACHE = os.getenv("LLM_PROMPT_CACHE", "0") == "1"
+LLM_SLOTS = int(os.getenv("LLM_SLOTS", "1"))
+
+
+class SlotAllocator:
+    """Sticky mapping of chat sessions to llama-server slots.
+
+    llama-server keeps the KV cache of the last prompt per slot (`--parallel N`
+    slots). Sending every request of a session to the same slot lets the server
+    reuse the cached prefix instead of re-evaluating the whole prompt. New sessions
+    take over the slot whose session was active least recently.
+    """
+
+    def __init__(self, slots: int = LLM_SLOTS):
+        self.slots = max(1, slots)
+        self._sessions: "OrderedDict[str, int]" = OrderedDict()
+
+    def slot_for(self, session_id: str) -> int:
+        slot = self._sessions.get(session_id)
+        if slot is not None:
+            self._sessions.move_to_end(session_id)
+            return slot
+
+        used = set(self._sessions.values())
+        free = [slot for slot in range(self.slots) if slot not in used]
+        if free:
+            slot = free[0]
+        else:
+            _, slot = self._sessions.popitem(last=False)
+        self._sessions[session_id] = slot
+        return slot
+
+
+class PromptCache:
+    """Builds the llama-server request extensions that enable prompt/KV-cache reuse."""
+
+    def __init__(self, enabled: bool = LLM_PROMPT_CACHE, slots: int = LLM_SLOTS):
+        self.enabled = enabled
+        self.allocator = SlotAllocator(slots)
+
+    def extra_body(self, session_id: Optional[str]) -> Optional[Dict]:
+        if not self.enabled:
+            return None
+        return {
+            "cache_prompt": True,
+            "id_slot": self.allocator.slot_for(session_id or "default"),
+        }
@@ -3,27 +3,21 @@ load_dotenv("../env.dev")
 
 import asyncio
 import json
-from PIL import Image
 import os
-import io
-import base64
-from fastmcp import Client
 from typing import List, Dict, Any, Union
 import gradio as gr
 from openai import AsyncOpenAI
 from gradio.components.chatbot import ChatMessage
-from fastmcp.client.client import CallToolResult
 
-from .tools import tool_definition_list
-from .mcp_utils import (
-    call_image_generation_tool,
-    call_image_describe_tool,
-    call_get_forecast_tool,
-    call_get_alerts_tool,
-    call_get_multiply_tool,
-    add_tool_response,
-    add_image_tool_response
-)
+from .mcp_session_pool import MCPSessionPool
+from .conversation_store import Conversation, ConversationStore
+from .context_manager import ContextManager
+from .tool_registry import ToolRegistry
+from .llm_slots import PromptCache
+from .tool_cache import ToolResultCache, tool_cache_key
+from .single_flight import SingleFlight
+from .image_store import LazyImage
+from .mcp_utils import ToolOutcome, append_tool_result_messages, add_tool_response, render_direct_answer
 
 loop = asyncio.new_event_loop()
 asyncio.set_event_loop(loop)
@@ -31,81 +25,219 @@ asyncio.set_event_loop(loop)
 MCP_SERVER_URL = os.getenv("MCP_SERVER_URL", "")
 OLLAMA_LLM_URL = os.getenv("OLLAMA_LLM_URL", "")
 
-class MCPClientWrapper:
-    def __init__(self):
-        self.model_name = "Meta-Llama-3.1-8B-Instruct-GGUF:Q4_K_M"
-        self.mcp_client = Client(f"{MCP_SERVER_URL}/mcp")
-        self.llm = AsyncOpenAI(
-            base_url = f"{OLLAMA_LLM_URL}/v1",
-            api_key='llama.cpp', # required, but unused
-        )
-        self.tools = tool_definition_list
-        self.claude_messages = []
-        self.result_messages = []
-        self.claude_messages.append({
-            "role": "system", 
-            "content": 
-"""
-You're a chatbot assistant. Your task is to heed the user instruction and decide whether to use the functions such as: 'generate_image', 'describe_image', 'get_forecast', 'get_alerts' with their respective parameters or not.
+# Max concurrent calls per tool across all sessions, image tools are bound by the model server.
+# Generations default to the image service's batch size, so concurrent requests can share a batch
+TOOL_DEFAULT_CONCURRENCY = int(os.getenv("TOOL_DEFAULT_CONCURRENCY", "8"))
+TOOL_CONCURRENCY_LIMITS = {
+    "generate_image": int(os.getenv("GENERATE_IMAGE_CONCURRENCY", os.getenv("DIFFUSION_MAX_BATCH", "4"))),
+    "describe_image": int(os.getenv("DESCRIBE_IMAGE_CONCURRENCY", "1")),
+}
+
+SYSTEM_PROMPT = """
+You're a chatbot assistant. Your task is to heed the user instruction and decide whether to use the functions such as: 'generate_image', 'describe_image', 'get_forecast', 'get_alerts', 'get_forecast_batch', 'get_alerts_batch' with their respective parameters or not.
 If the user's question are general, just response with conversational manner.
 If function are needed, response with JSON format with the required parameters.
 Use these function definitions to help you identifying the tasks:
-For function 'generate_image', you must reponse with a JSON object with three key and value pairs representing three paramters: 'prompt', 'width' and 'height'.
+For function 'generate_image', you must reponse with a JSON object with the 'prompt' parameter, and 'width' and 'height' only when the user asks for a size. Only add a 'tier' of 'standard' or 'high' when the user asks for a higher quality image, otherwise leave it out to get a fast preview.
 For function 'describe_image', you must response with a JSON object in the 'prompt' key with prompt representing the additional detail prompt for the image description as the parameter.
 For function 'get_alerts', you must response with a JSON object with a key and value pair representing the US state in the format of two-letter (e.g CA, NY) as parameter.
-For function 'get_forecast', if the latitude and longtitude are given by the user, use that and response with a JSON object representing two key and value pairs for 'latitude' and 'longtitude' parameters. If both of those are provided, figure it out yourself.
+For function 'get_forecast', if the latitude and longtitude are given by the user, use that and response with a JSON object representing two key and value pairs for 'latitude' and 'longtitude' parameters. Otherwise do not guess coordinates, pass the US city the user mentioned as the 'place' parameter (e.g. 'Austin, TX').
+When the user asks about several states or locations at once (e.g. to compare them), use 'get_alerts_batch' with a 'states' list or 'get_forecast_batch' with a 'locations' list of objects with 'latitude' and 'longtitude' or 'place', instead of calling 'get_alerts' or 'get_forecast' several times.
+Weather results that end with '(N more available, call again with compact=true and cursor=K)' are cut short; only call the same function again with 'compact' set to true and 'cursor' set to K if the user needs the rest. Batch results name the single-item function and arguments to call instead.
 For function 'get_multiply', you must response with a JSON object with two key and value pairs representing the 'first_number' and the 'second_number' as parameters for the multiplication.
 """
-        })
+
+class MCPClientWrapper:
+    def __init__(self):
+        self.model_name = "Meta-Llama-3.1-8B-Instruct-GGUF:Q4_K_M"
+        self.mcp_pool = MCPSessionPool(f"{MCP_SERVER_URL}/mcp")
+        self.llm = AsyncOpenAI(
+            base_url = f"{OLLAMA_LLM_URL}/v1",
+            api_key='llama.cpp', # required, but unused
+        )
+        self.registry = ToolRegistry()
+        self.conversations = ConversationStore(system_prompt=SYSTEM_PROMPT)
+        self.context = ContextManager(llm=self.llm, model_name=self.model_name)
+        self._tool_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.prompt_cache = PromptCache()
+        self.tool_cache = ToolResultCache()
+        self.tool_flights = SingleFlight()
         
     async def check_connection(self):
-        async with self.mcp_client:
-            await self.mcp_client.ping()
+        async with self.mcp_pool.session() as mcp_client:
+            await mcp_client.ping()
             print("Server is reachable")
     
     async def _connect(self) -> str:
-        async with self.mcp_client:
-            self.mcp_client.session.__aenter__
-            print(f"Client connected: {self.mcp_client.is_connected()}")
+        await self.mcp_pool.start()
+        async with self.mcp_pool.session() as mcp_client:
+            print(f"Client connected: {mcp_client.is_connected()}")
+
+        # Load the tool schemas once at startup, later turns only refresh them after the TTL
+        await self.registry.refresh(self.mcp_pool)
+        print(f"Connected to MCP server. Available tools: {', '.join(self.registry.names)}")
 
-            # Make MCP calls within the context
-            tools = await self.mcp_client.list_tools()
-            print(f"Connected to MCP server. Available tools: {', '.join([t.name for t in tools])}")
+    async def close(self):
+        await self.mcp_pool.close()
 
-    async def process_message(self, message: str, history: List[Union[Dict[str, Any], ChatMessage]], img):
+    async def process_message(self, message: str, history: List[Union[Dict[str, Any], ChatMessage]], img, session_id: str = None):
         # Initialize image_data to None
         image_data = None
         
-        # Async generator to stream partial responses from _process_query
-        async for partial_messages, partial_image_data in self._process_query(message, history, img):
-            image_data = partial_image_data
-            yield history + partial_messages, gr.Textbox(value=""), image_data
+        rendered = False
+        
+        # Each Gradio session has its own conversation, turns of one session run one at a time
+        conversation = self.conversations.get(session_id)
+        async with conversation.lock:
+            # Async generator to stream partial responses from _process_query
+            async for partial_messages, partial_image_data in self._process_query(message, history, img, conversation):
+                if rendered and partial_image_data is image_data:
+                    # Unchanged image, skip re-sending (and re-encoding) it on every streamed chunk
+                    image_output = gr.skip()
+                else:
+                    image_data = partial_image_data
+                    image_output = image_data.to_pil() if isinstance(image_data, LazyImage) else image_data
+                    rendered = True
+                yield history + partial_messages, gr.Textbox(value=""), image_output
 
-    async def _get_model_response_tool(self, message: str, history: List[Union[Dict[str, Any], ChatMessage]]):
+    async def _get_model_response_tool(self, message: str, history: List[Union[Dict[str, Any], ChatMessage]], session_id: str = None):
         response = await self.llm.chat.completions.create(
             model=self.model_name,
             messages=message,
-            tools=self.tools,
-            tool_choice='auto'
+            tools=self.registry.definitions,
+            tool_choice='auto',
+            extra_body=self.prompt_cache.extra_body(session_id)
         )
         return response
     
-    async def _process_query(self, message: str, history: List[Union[Dict[str, Any], ChatMessage]], img):
-        self.result_messages = []
+    def _final_response_kwargs(self, session_id: str = None) -> Dict:
+        extra_body = self.prompt_cache.extra_body(session_id)
+        if extra_body is None:
+            return {}
+        # Same tool block as the tool-decision call, so both requests share one cached prefix
+        return {
+            "tools": self.registry.definitions,
+            "tool_choice": "none",
+            "extra_body": extra_body
+        }
+    
+    def _tool_semaphore(self, tool_name: str) -> asyncio.Semaphore:
+        semaphore = self._tool_semaphores.get(tool_name)
+        if semaphore is None:
+            limit = TOOL_CONCURRENCY_LIMITS.get(tool_name, TOOL_DEFAULT_CONCURRENCY)
+            semaphore = self._tool_semaphores[tool_name] = asyncio.Semaphore(limit)
+        return semaphore
+    
+    async def _run_tool_call(self, tool_call, img):
+        """Run one tool call and return its arguments, adapted outcome and UI messages."""
+        tool_id = tool_call.id
+        tool_name = tool_call.function.name
+        print(f"[TOOL] - {tool_id} - {tool_name}")
         
-        for msg in history:
-            if isinstance(msg, ChatMessage):
-                role, content = msg.role, msg.content
-            else:
-                role, content = msg.get("role"), msg.get("content")
-            
-            if role in ["user", "assistant", "system"]:
-                self.claude_messages.append({"role": role, "content": content})
+        # Try to parse tool arguments
+        try:
+            tool_args = json.loads(tool_call.function.arguments)
+        except json.JSONDecodeError:
+            tool_args = {"raw_args": tool_call.function.arguments}
+        
+        # Each call collects its own UI messages so concurrent calls do not interleave
+        result_messages = []
+        
+        # Add initial tool use message
+        result_messages.append({
+            "role": "assistant",
+            "content": f"I'll use the {tool_name} tool to help answer your question.",
+            "metadata": {
+                "title": f"Using tool: {tool_name}",
+                "log": f"Parameters: {json.dumps(tool_args, ensure_ascii=True)}",
+                "status": "pending",
+                "id": f"tool_call_{tool_id}"
+            }
+        })
         
-        # self.claude_messages.append({"role": "user", "content": message})
+        # Add tool parameters message
+        result_messages.append({
+            "role": "assistant",
+            "content": "```json\n" + json.dumps(tool_args, indent=2, ensure_ascii=True) + "\n```",
+            "metadata": {
+                "parent_id": f"tool_call_{tool_id}",
+                "id": f"params_{tool_id}",
+                "title": "Tool Parameters"
+            }
+        })
+        
+        print(f"TOOL ARGS: {tool_args}")
+        if tool_name not in self.registry:
+            outcome = ToolOutcome.error(f"Unknown tool {tool_name}")
+        else:
+            try:
+                outcome = await self._call_tool(tool_name, self.registry.filter_arguments(tool_name, tool_args), img)
+            except Exception as e:
+                # One failing tool must not cancel the sibling calls
+                print(f"[TOOL] - {tool_id} - {tool_name} failed: {e}")
+                outcome = ToolOutcome.error()
+        
+        append_tool_result_messages(result_messages, tool_name, tool_id, outcome)
+        return tool_args, outcome, result_messages
+    
+    async def _call_tool(self, tool_name: str, arguments: Dict, img) -> ToolOutcome:
+        """Call a tool through its registered handler and adapter.
+        
+        Cacheable tools are served from the result cache when possible, and identical
+        calls already in flight are shared instead of being sent again.
+        """
+        ttl = self.tool_cache.ttl_for(
+            tool_name,
+            annotations=self.registry.annotations(tool_name),
+            declared_ttl=self.registry.cache_ttl(tool_name)
+        )
+        if ttl <= 0:
+            return await self._invoke_tool(tool_name, arguments, img)
+        
+        cache_key = tool_cache_key(tool_name, arguments)
+        outcome = self.tool_cache.get(cache_key)
+        if outcome is not None:
+            print(f"[TOOL CACHE] Hit {cache_key} - {self.tool_cache.stats()}")
+            return outcome
+        
+        async def invoke_and_cache() -> ToolOutcome:
+            outcome = await self._invoke_tool(tool_name, arguments, img)
+            # Failures and stale answers would outlive the outage they come from
+            if not outcome.is_error and not outcome.degraded:
+                self.tool_cache.set(cache_key, outcome, ttl)
+            return outcome
+        
+        return await self.tool_flights.do(cache_key, invoke_and_cache)
+    
+    async def _invoke_tool(self, tool_name: str, arguments: Dict, img) -> ToolOutcome:
+        handler = self.registry.handler(tool_name)
+        adapter = self.registry.adapter(tool_name)
+        async with self._tool_semaphore(tool_name):
+            result = await handler(self.mcp_pool, tool_name, arguments, img=img)
+        return adapter(tool_name, arguments, result)
+    
+    def _direct_answer(self, tool_calls, outcomes) -> str | None:
+        answers = []
+        for tool_call, (tool_args, outcome, _) in zip(tool_calls, outcomes):
+            template = self.registry.direct_answer(tool_call.function.name)
+            answer = render_direct_answer(template, tool_args, outcome) if template else None
+            if answer is None:
+                return None
+            answers.append(answer)
+        return "\n\n".join(answers)
+    
+    async def _process_query(self, message: str, history: List[Union[Dict[str, Any], ChatMessage]], img, conversation: Conversation):
+        result_messages = []
         
-        print(f"[MESSAGE FIRST] - {self.claude_messages}")
-        response = await self._get_model_response_tool(self.claude_messages, history=history)
+        await self.registry.ensure_fresh(self.mcp_pool)
+        
+        # Only the turns added since the previous call are appended
+        conversation.sync_history(history)
+        claude_messages = conversation.messages
+        
+        prompt_messages = await self.context.prepare(conversation)
+        print(f"[MESSAGE FIRST] - {prompt_messages}")
+        response = await self._get_model_response_tool(prompt_messages, history=history, session_id=conversation.session_id)
         
         # Get the first choice from response
         choice = response.choices[0]
@@ -114,150 +246,62 @@ For function 'get_multiply', you must response with a JSON object with two key a
         
         image_data = None
         
-        # Handle regular text response
+        # Handle regular text response, the first call already produced the complete answer
         if not message.tool_calls:
-            self.result_messages.append({
-                "role": "assistant",
-                "content": message.content
-            })
             print(f"[RESULT MES] - First res: {message.content}")
+            yield [{"role": "assistant", "content": message.content or ""}], image_data
+            return
         else:
-            # Handle tool calls like in your Anthropic code
-            for tool_call in message.tool_calls:
-                tool_id = tool_call.id
-                tool_name = tool_call.function.name
-                print(f"[TOOL] - {tool_id} - {tool_name}")
-                
-                # Try to parse tool arguments
-                try:
-                    tool_args = json.loads(tool_call.function.arguments)
-                except json.JSONDecodeError:
-                    tool_args = {"raw_args": tool_call.function.arguments}
-                
-                # Add initial tool use message
-                self.result_messages.append({
-                    "role": "assistant",
-                    "content": f"I'll use the {tool_name} tool to help answer your question.",
-                    "metadata": {
-                        "title": f"Using tool: {tool_name}",
-                        "log": f"Parameters: {json.dumps(tool_args, ensure_ascii=True)}",
-                        "status": "pending",
-                        "id": f"tool_call_{tool_name}"
-                    }
-                })
-                
-                # Add tool parameters message
-                self.result_messages.append({
-                    "role": "assistant",
-                    "content": "```json\n" + json.dumps(tool_args, indent=2, ensure_ascii=True) + "\n```",
-                    "metadata": {
-                        "parent_id": f"tool_call_{tool_name}",
-                        "id": f"params_{tool_name}",
-                        "title": "Tool Parameters"
-                    }
-                })
-                
-                print(f"[RESULT MES] AFTER TOOL: {self.result_messages}")
-                
-                result = "Fail to get the server response"
-                
-                print(f"TOOL ARGS: {tool_args}")
-                if tool_name == "generate_image":
-                    result: CallToolResult | list[dict] | list = await call_image_generation_tool(
-                        mcp_client=self.mcp_client,
-                        tool_args=tool_args,
-                        result_messages=self.result_messages,
-                        tool_name=tool_name
-                    )
-                    # Extract image bytes from result
-                    if result and isinstance(result, CallToolResult) and hasattr(result, "data"):
-                        image_bytes = base64.b64decode(result.data)
-                        # Convert bytes to PIL Image
-                        image = Image.open(io.BytesIO(image_bytes))
-                        image_data = image
-                elif tool_name == "describe_image":
-                    result: CallToolResult | str = await call_image_describe_tool(
-                        file_byte=img,
-                        mcp_client=self.mcp_client,
-                        tool_args=tool_args,
-                        result_messages=self.result_messages,
-                        tool_name=tool_name
-                    )
-                elif tool_name == "get_forecast":
-                    result: CallToolResult | list[dict] | str = await call_get_forecast_tool(
-                        mcp_client=self.mcp_client,
-                        tool_args=tool_args,
-                        result_messages=self.result_messages,
-                        tool_name=tool_name
-                    )
-                elif tool_name == "get_alerts":
-                    result: CallToolResult | list[dict] | str = await call_get_alerts_tool(
-                        mcp_client=self.mcp_client,
-                        tool_args=tool_args,
-                        result_messages=self.result_messages,
-                        tool_name=tool_name
-                    )
-                elif tool_name == "get_multiply":
-                    result: CallToolResult | list[dict] = await call_get_multiply_tool(
-                        mcp_client=self.mcp_client,
-                        tool_args=tool_args,
-                        result_messages=self.result_messages,
-                        tool_name=tool_name
-                    )
-                print(f"[RESULT MES] RESULT TOOL CALL MESSAGE: {self.result_messages}")
+            # Dispatch every tool call of the assistant message concurrently, results keep the call order
+            outcomes = await asyncio.gather(*[
+                self._run_tool_call(tool_call, img) for tool_call in message.tool_calls
+            ])
             
             # Get model to respond to tool output (second call)
             # Add tool results to messages
-            self.claude_messages.append({
+            claude_messages.append({
                 "role": "assistant",
                 "tool_calls": [
                     {
-                        "id": tool_id,
+                        "id": tool_call.id,
                         "type": "function",
                         "function": {
-                            "name": tool_name,
+                            "name": tool_call.function.name,
                             "arguments": tool_call.function.arguments
                         }
                     }
+                    for tool_call in message.tool_calls
                 ]
             })
             
-            # Retrieve the tool repsonse and add it in the LLM chat completion
-            # Modify each tool response format if necessary.
-            if tool_name == "generate_image":
-                tool_response: dict = add_image_tool_response(
-                    result=tool_args.get("prompt", ""),
-                    tool_id=tool_id,
-                    tool_name=tool_name
-                )
-            elif tool_name == "describe_image":
-                tool_response: dict = add_tool_response(
-                    tool_name=tool_name,
-                    result=result,
-                    tool_id=tool_id
-                )
-            elif tool_name == "get_multiply":
-                tool_response: dict = add_tool_response(
-                    tool_name=tool_name,
-                    result=result,
-                    tool_id=tool_id
-                )
-            elif tool_name == "get_alerts" or tool_name == "get_forecast":
-                tool_response: dict = add_tool_response(
-                    tool_name=tool_name,
-                    result=result,
-                    tool_id=tool_id
-                )
+            for tool_call, (tool_args, outcome, tool_messages) in zip(message.tool_calls, outcomes):
+                result_messages.extend(tool_messages)
+                if outcome.image is not None:
+                    image_data = outcome.image
                 
-            print(f"[TOOL RESPONSE] {tool_response}")
-            self.claude_messages.append(tool_response)
+                # Retrieve the tool repsonse and add it in the LLM chat completion
+                claude_messages.append(add_tool_response(
+                    outcome=outcome,
+                    tool_id=tool_call.id,
+                    tool_name=tool_call.function.name
+                ))
+            print(f"[RESULT MES] RESULT TOOL CALL MESSAGE: {result_messages}")
+            
+            # Deterministic tool results are rendered from a template, no second LLM call needed
+            direct_answer = self._direct_answer(message.tool_calls, outcomes)
+            if direct_answer is not None:
+                print(f"[DIRECT ANSWER] {direct_answer}")
+                yield [{"role": "assistant", "content": direct_answer}], image_data
+                return
         
-        print(f"[FINAL_MESSAGE] GOT CLAUDE MESSAGE: {self.claude_messages}")
+        prompt_messages = await self.context.prepare(conversation)
+        print(f"[FINAL_MESSAGE] GOT CLAUDE MESSAGE: {prompt_messages}")
         # Get final response after tool use
         final_response = await self.llm.chat.completions.create(
             model=self.model_name,
-            messages=self.claude_messages,
-            stream=True
+            messages=prompt_messages,
+            stream=True,
+            **self._final_response_kwargs(conversation.session_id)
         )
         
         partial_content = ""
@@ -0,0 +1,138 @@
+import os
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
+
+from fastmcp import Client
+from fastmcp.exceptions import ToolError
+
+from .logging_utils import logger
+
+MCP_POOL_SIZE = int(os.getenv("MCP_POOL_SIZE", "4"))
+MCP_POOL_HEALTH_CHECK_INTERVAL = float(os.getenv("MCP_POOL_HEALTH_CHECK_INTERVAL", "30"))
+MCP_POOL_CONNECT_RETRIES = int(os.getenv("MCP_POOL_CONNECT_RETRIES", "2"))
+
+
+class _PooledSession:
+    """One slot of the pool: a long-lived, already initialized MCP client."""
+
+    def __init__(self, template: Client):
+        self.template = template
+        self.client: Optional[Client] = None
+        self.last_checked = 0.0
+
+    @property
+    def connected(self) -> bool:
+        return self.client is not None and self.client.is_connected()
+
+    async def connect(self):
+        # Always start from fresh session state so a broken transport is never reused
+        client = self.template.new()
+        await client.__aenter__()
+        self.client = client
+        self.last_checked = time.monotonic()
+
+    async def disconnect(self):
+        client, self.client = self.client, None
+        if client is None:
+            return
+        try:
+            await client.close()
+        except Exception as e:
+            logger.info(f"[MCP_POOL] Error while closing session: {e}")
+
+
+class MCPSessionPool:
+    """Long-lived pool of connected MCP sessions shared by all tool calls.
+
+    Sessions are opened lazily, health-checked with a ping when they have been
+    idle for longer than `health_check_interval` and re-established whenever a
+    call fails for a reason other than a tool error.
+    """
+
+    def __init__(
+        self,
+        server_url: str,
+        size: int = MCP_POOL_SIZE,
+        health_check_interval: float = MCP_POOL_HEALTH_CHECK_INTERVAL,
+        connect_retries: int = MCP_POOL_CONNECT_RETRIES,
+    ):
+        self.server_url = server_url
+        self.size = max(1, size)
+        self.health_check_interval = health_check_interval
+        self.connect_retries = max(0, connect_retries)
+        self._template = Client(server_url)
+        self._slots: List[_PooledSession] = []
+        self._idle: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._idle is not None and self._loop is loop:
+            return
+        if self._loop is not None and self._loop is not loop:
+            # Sessions belong to the loop that opened them (e.g. a startup asyncio.run),
+            # they cannot be reused or even closed cleanly from another loop.
+            logger.info("[MCP_POOL] Event loop changed, rebuilding the session pool")
+        self._loop = loop
+        self._slots = [_PooledSession(self._template) for _ in range(self.size)]
+        self._idle = asyncio.Queue()
+        for slot in self._slots:
+            self._idle.put_nowait(slot)
+
+    async def start(self):
+        """Open every session of the pool up front instead of on first use."""
+        self._ensure_started()
+        slots = [await self._idle.get() for _ in range(self.size)]
+        try:
+            await asyncio.gather(*[self._checkout(slot) for slot in slots])
+        finally:
+            for slot in slots:
+                self._idle.put_nowait(slot)
+
+    async def _checkout(self, slot: _PooledSession) -> Client:
+        if slot.connected and time.monotonic() - slot.last_checked > self.health_check_interval:
+            try:
+                await slot.client.ping()
+                slot.last_checked = time.monotonic()
+            except Exception as e:
+                logger.info(f"[MCP_POOL] Health check failed, reconnecting: {e}")
+                await slot.disconnect()
+
+        attempt = 0
+        while not slot.connected:
+            try:
+                await slot.connect()
+            except Exception:
+                await slot.disconnect()
+                if attempt >= self.connect_retries:
+                    raise
+                attempt += 1
+                await asyncio.sleep(0.2 * attempt)
+        return slot.client
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[Client]:
+        """Borrow a connected client from the pool for the duration of the block."""
+        self._ensure_started()
+        idle = self._idle
+        slot: _PooledSession = await idle.get()
+        try:
+            client = await self._checkout(slot)
+            try:
+                yield client
+            except ToolError:
+                # The server answered, the session itself is healthy
+                raise
+            except BaseException:
+                await slot.disconnect()
+                raise
+            slot.last_checked = time.monotonic()
+        finally:
+            idle.put_nowait(slot)
+
+    async def close(self):
+        if self._idle is None or self._loop is not asyncio.get_running_loop():
+            return
+        await asyncio.gather(*[slot.disconnect() for slot in self._slots])
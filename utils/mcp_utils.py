@@ -1,415 +1,229 @@
-import json
 import base64
-import traceback
-from fastmcp import Client
-from typing import List, Dict, Optional
+import hashlib
+from typing import Any, Dict, List, Optional
 from io import BytesIO
 from PIL import Image
+from mcp.types import ImageContent, TextContent
 from fastmcp.client.client import CallToolResult
 
+from .mcp_session_pool import MCPSessionPool
+from .image_store import ImageStore, LazyImage, image_digest
 
-async def call_image_generation_tool(
-    mcp_client: Client, 
+
+class ToolOutcome:
+    """Adapted result of one tool call.
+
+    Args:
+        text: Content handed back to the LLM as the tool message
+        display: Raw output shown in the chat UI
+        image: Image to display in the UI, if the tool produced one
+        is_error: Whether the call failed
+        fields: Structured values of the result, available to direct answer templates
+        degraded: Whether the answer was built from stale data, it is not cached
+    """
+
+    def __init__(
+        self,
+        text: str,
+        display: Optional[str] = None,
+        image: Any = None,
+        is_error: bool = False,
+        fields: Optional[Dict] = None,
+        degraded: bool = False
+    ):
+        self.text = text
+        self.display = text if display is None else display
+        self.image = image
+        self.is_error = is_error
+        self.fields = fields or {}
+        self.degraded = degraded
+
+    @classmethod
+    def error(cls, message: str = "Fail to get the server response") -> "ToolOutcome":
+        return cls(text=message, is_error=True)
+
+
+async def call_mcp_tool(
+    mcp_pool: MCPSessionPool,
+    tool_name: str,
     tool_args: Dict,
-    result_messages: List[Dict],
-    tool_name: str
-) -> List[Dict] | CallToolResult | str | Dict:
-    
-    try:
-        async with mcp_client:
-            result: CallToolResult = await mcp_client.call_tool(
-                name="generate_image", 
-                arguments=dict(
-                    prompt=tool_args.get("prompt", ""),
-                    width=tool_args.get("width", 512),
-                    height=tool_args.get("height", 512)
-                )
-            )
-        
-        # Update the status of the tool call
-        if result_messages and "metadata" in result_messages[-2]:
-            result_messages[-2]["metadata"]["status"] = "done"
-        
-        # Add a header for the tool results
-        result_messages.append({
-            "role": "assistant",
-            "content": "Here are the results from the tool:",
-            "metadata": {
-                "title": f"Tool Result for {tool_name}",
-                "status": "done",
-                "id": f"result_{tool_name}"
-            }
-        })
-    except TimeoutError as e:
-        print("Request timed out")
-        result = [{"text": "Request timed out"}]
-        result_messages.append({
-            "role": "assistant",
-            "content": "```\nRequest timed out\n```",
-            "metadata": {
-                "parent_id": f"result_{tool_name}",
-                "id": f"raw_result_{tool_name}",
-                "status": "done",
-                "title": "Raw Output"
-            }
-        })
-        raise TimeoutError(e)
-    except Exception as e_else:
-        result = [{"text": "Fail to get the server response"}]
-        result_messages.append({
-            "role": "assistant",
-            "content": "```\n" + result + "\n```",
-            "metadata": {
-                "parent_id": f"result_{tool_name}",
-                "id": f"raw_result_{tool_name}",
-                "status": "done",
-                "title": "Raw Output"
-            }
-        })
-        raise Exception(e_else)
-    
-    print(f"[TOOL CALL] Generate_image: Result - {result} - {type(result)}")
-    result_content = result.data
-    byte_data = base64.b64decode(result_content)
-                    
-    try:
-        print(f"[TOOL CALL] result JSON: {result_content}")
-        if isinstance(byte_data, bytes):
-            result_messages.append({
-                "role": "assistant",
-                "content": "Here are the results from the tool:",
-                "metadata": {
-                    "parent_id": f"result_{tool_name}",
-                    "id": f"image_{tool_name}",
-                    "status": "done",
-                    "title": "Generated Image"
-                }
-            })
-        else:
-            result_messages.append({
-                "role": "assistant",
-                "content": "Failed to get the generated image.",
-                "metadata": {
-                    "parent_id": f"result_{tool_name}",
-                    "id": f"raw_result_{tool_name}",
-                    "status": "done",
-                    "title": "Raw Output"
-                }
-            })
-    except Exception as err:
-        result_messages.append({
-            "role": "assistant",
-            "content": "Failed to get the generated image.",
-            "metadata": {
-                "parent_id": f"result_{tool_name}",
-                "id": f"raw_result_{tool_name}",
-                "title": "Raw Output",
-                "status": "done",
-            }
-        })
-        raise Exception(err)
+    **context
+) -> CallToolResult:
+    """Default handler: forward the arguments to the MCP tool of the same name."""
+    async with mcp_pool.session() as mcp_client:
+        # Tool errors come back as results, so adapters can hand their message to the LLM
+        result: CallToolResult = await mcp_client.call_tool(name=tool_name, arguments=tool_args, raise_on_error=False)
+    print(f"[TOOL CALL] {tool_name}: Result - {result}")
     return result
 
 
+# Encoded uploads keyed by a hash of their pixels, and the content hashes already sent to the server
+# Entries are (digest, JPEG bytes), only the bytes count against the budget
+encoded_uploads = ImageStore(sizeof=lambda entry: len(entry[1]))
+sent_image_ids = ImageStore(max_bytes=4096, sizeof=lambda _: 1)
+
+
+def encode_upload(img: Image.Image) -> tuple[str, bytes]:
+    """JPEG-encode an uploaded image once and return its content hash and bytes."""
+    pixels_key = hashlib.sha1(img.tobytes()).hexdigest() + f"{img.size}{img.mode}"
+    encoded = encoded_uploads.get(pixels_key)
+    if encoded is None:
+        buffered = BytesIO()
+        img.convert("RGB").save(buffered, format="JPEG", quality=90)
+        data = buffered.getvalue()
+        encoded = (image_digest(data), data)
+        encoded_uploads.put(pixels_key, encoded)
+    return encoded
+
+
 async def call_image_describe_tool(
-    mcp_client: Client,
-    file_byte: Image.Image,
+    mcp_pool: MCPSessionPool,
+    tool_name: str,
     tool_args: Dict,
-    result_messages: List[Dict],
-    tool_name: str
-) -> List[Dict] | CallToolResult | str | Dict:
-    
+    img: Image.Image = None,
+    **context
+) -> CallToolResult:
+    """Handler for describe_image, the uploaded image travels in-band with the call.
+
+    Only the content hash is sent for an image the server already received; the
+    bytes follow when the server reports it does not hold that image (anymore).
+    """
+    if img is None:
+        raise ValueError("No image was uploaded to describe")
+    image_id, data = encode_upload(img)
+
+    arguments = {**tool_args, "image_id": image_id}
+    if image_id not in sent_image_ids:
+        arguments["image_data"] = base64.b64encode(data).decode("utf-8")
+    result = await call_mcp_tool(mcp_pool, tool_name, arguments)
+
+    if (result.structured_content or {}).get("status") == "missing_image" and "image_data" not in arguments:
+        arguments["image_data"] = base64.b64encode(data).decode("utf-8")
+        result = await call_mcp_tool(mcp_pool, tool_name, arguments)
+    sent_image_ids.put(image_id, True)
+    return result
+
+
+def result_text(result: CallToolResult | Dict | str) -> str:
+    """Extract the text of a tool result, whether it is structured or plain content."""
+    if isinstance(result, CallToolResult):
+        structured = result.structured_content
+        if isinstance(structured, dict):
+            if "message" in structured:
+                return str(structured["message"])
+            if isinstance(structured.get("result"), str):
+                return structured["result"]
+        return "\n".join(block.text for block in result.content if isinstance(block, TextContent))
+    if isinstance(result, dict):
+        return str(result.get("message", result))
+    return str(result)
+
+
+def text_result_adapter(tool_name: str, tool_args: Dict, result: CallToolResult) -> ToolOutcome:
+    structured = result.structured_content if isinstance(result, CallToolResult) else None
+    structured = structured if isinstance(structured, dict) else None
+    return ToolOutcome(
+        text=result_text(result),
+        fields=structured,
+        is_error=getattr(result, "is_error", False),
+        degraded=bool(structured and structured.get("degraded"))
+    )
+
+
+def describe_result_adapter(tool_name: str, tool_args: Dict, result: CallToolResult) -> ToolOutcome:
+    status = (result.structured_content or {}).get("status", "success")
+    if result.is_error or status != "success":
+        return ToolOutcome(text=f"Failed to describe the image: {result_text(result)}", is_error=True)
+    return ToolOutcome(text=f"The description of the image is {result_text(result)}")
+
+
+def image_result_adapter(tool_name: str, tool_args: Dict, result: CallToolResult) -> ToolOutcome:
+    images = [block for block in result.content if isinstance(block, ImageContent)]
+    if not images:
+        # The server answers with a status dict when the generation failed
+        return ToolOutcome(text=f"Image generated Failed. {result_text(result)}", is_error=True)
+
+    # The only decode of the payload, the pixels are materialized when the UI renders it
+    image = LazyImage(base64.b64decode(images[0].data), mime_type=images[0].mimeType)
+    return ToolOutcome(
+        text=f"Image generated successfully with prompt {tool_args.get('prompt', '')}",
+        display="Generated Image",
+        image=image
+    )
+
+
+def render_direct_answer(template: str, tool_args: Dict, outcome: ToolOutcome) -> Optional[str]:
+    """Fill a direct answer template from the tool arguments and result fields.
+
+    Returns None when the call failed or the template needs a value the result does
+    not have, the caller then lets the LLM write the answer instead.
+    """
+    if outcome.is_error:
+        return None
     try:
-        file_byte.save("../input.jpg")
-        async with mcp_client:
-            # Convert bytes to base64 string for sending
-            # b64_image = base64.b64encode(file_bytes).decode('utf-8')
-            result: CallToolResult = await mcp_client.call_tool(
-                name="describe_image",
-                arguments=dict(
-                    prompt=tool_args.get("prompt", "")
-                )
-            )
-        
-        # Update the status of the tool call
-        if result_messages and "metadata" in result_messages[-2]:
-            result_messages[-2]["metadata"]["status"] = "done"
-        
-        # Add a header for the tool results
-        result_messages.append({
-            "role": "assistant",
-            "content": "Here are the results from the tool:",
-            "metadata": {
-                "title": f"Tool Result for {tool_name}",
-                "status": "done",
-                "id": f"result_{tool_name}"
-            }
-        })
-    except Exception as e:
-        print(traceback.format_exc(), e)
-        result = "Fail to get the server response."
-        result_messages.append({
-            "role": "assistant",
-            "content": "```\n" + result + "\n```",
-            "metadata": {
-                "parent_id": f"result_{tool_name}",
-                "id": f"raw_result_{tool_name}",
-                "status": "done",
-                "title": "Raw Output"
-            }
-        })
-        raise Exception(e)
-        
-    print(f"[TOOL CALL] Image_analyze: Result - {result} - {type(result)}")
-    # Process the result content - assuming result is a string
-    result_content: dict = result.structured_content
-    content_message = f"The description of the image is {result_content['message']}"
-    
+        return template.format(**{**tool_args, **outcome.fields, "text": outcome.text})
+    except (KeyError, IndexError, ValueError):
+        return None
+
+
+def append_tool_result_messages(
+    result_messages: List[Dict],
+    tool_name: str,
+    tool_id: str,
+    outcome: ToolOutcome
+):
+    """Add the UI messages describing a finished tool call."""
+    # Update the status of the tool call
+    for message in result_messages:
+        if message.get("metadata", {}).get("id") == f"tool_call_{tool_id}":
+            message["metadata"]["status"] = "done"
+
+    # Add a header for the tool results
     result_messages.append({
         "role": "assistant",
-        "content": "```\n" + content_message + "\n```",
+        "content": "Here are the results from the tool:",
         "metadata": {
-            "parent_id": f"result_{tool_name}",
-            "id": f"raw_result_{tool_name}",
-            "title": "Raw Output",
+            "title": f"Tool Result for {tool_name}",
             "status": "done",
+            "id": f"result_{tool_id}"
         }
     })
-        
-    return content_message
 
-async def call_get_forecast_tool(
-    mcp_client: Client,
-    tool_args: Dict,
-    result_messages: List[Dict],
-    tool_name: str
-) -> List[Dict] | CallToolResult | str | Dict:
-    try:
-        async with mcp_client:
-            result: str = await mcp_client.call_tool(
-                name="get_forecast", 
-                arguments=dict(
-                    latitude=tool_args.get("latitude"),
-                    longtitude=tool_args.get("longtitude")
-                )
-            )
-        print(f"[TOOL CALL] Get_forecast: Result - {result}")
-        
-        # Update the status of the tool call
-        if result_messages and "metadata" in result_messages[-2]:
-            result_messages[-2]["metadata"]["status"] = "done"
-        
-        # Add a header for the tool results
+    if outcome.image is not None:
         result_messages.append({
             "role": "assistant",
             "content": "Here are the results from the tool:",
             "metadata": {
-                "title": f"Tool Result for {tool_name}",
-                "status": "done",
-                "id": f"result_{tool_name}"
-            }
-        })
-        
-        # Process the result content - assuming result is a string
-        result_content = result
-        
-        result_messages.append({
-            "role": "assistant",
-            "content": "```\n" + result_content + "\n```",
-            "metadata": {
-                "parent_id": f"result_{tool_name}",
-                "id": f"raw_result_{tool_name}",
-                "title": "Raw Output",
-                "status": "done",
-            }
-        })
-        
-        print(f"[RESULT MES] RESULT TOOL CALL MESSAGE: {result_messages}")
-    except:
-        result = "Fail to get the server response"
-        result_messages.append({
-            "role": "assistant",
-            "content": "```\n" + result + "\n```",
-            "metadata": {
-                "parent_id": f"result_{tool_name}",
-                "id": f"raw_result_{tool_name}",
+                "parent_id": f"result_{tool_id}",
+                "id": f"image_{tool_id}",
                 "status": "done",
-                "title": "Raw Output"
+                "title": "Generated Image"
             }
         })
-        
-    return result
+        return
 
-async def call_get_alerts_tool(
-    mcp_client: Client,
-    tool_args: Dict,
-    result_messages: List[Dict],
-    tool_name: str
-) -> List[Dict] | CallToolResult | str | Dict:
-    try:
-        async with mcp_client:
-            result: str = await mcp_client.call_tool(
-                name="get_alerts",
-                arguments=dict(
-                    state=tool_args.get("state")
-                )
-            )
-            
-        print(f"[TOOL CALL] Get_alerts: Result - {result}")
-        
-        # Update the status of the tool call
-        if result_messages and "metadata" in result_messages[-2]:
-            result_messages[-2]["metadata"]["status"] = "done"
-        
-        # Add a header for the tool results
-        result_messages.append({
-            "role": "assistant",
-            "content": "Here are the results from the tool:",
-            "metadata": {
-                "title": f"Tool Result for {tool_name}",
-                "status": "done",
-                "id": f"result_{tool_name}"
-            }
-        })
-        
-        # Process the result content - assuming result is a string
-        result_content = result
-        
-        result_messages.append({
-            "role": "assistant",
-            "content": "```\n" + result_content + "\n```",
-            "metadata": {
-                "parent_id": f"result_{tool_name}",
-                "id": f"raw_result_{tool_name}",
-                "status": "done",
-                "title": "Raw Output"
-            }
-        })
-        print(f"[RESULT MES] RESULT TOOL CALL MESSAGE: {result_messages}")
-    
-    except:
-        result = "Fail to get the server response"
-        result_messages.append({
-            "role": "assistant",
-            "content": "```\n" + result + "\n```",
-            "metadata": {
-                "parent_id": f"result_{tool_name}",
-                "id": f"raw_result_{tool_name}",
-                "status": "done",
-                "title": "Raw Output"
-            }
-        })
-        
-    return result
+    result_messages.append({
+        "role": "assistant",
+        "content": "```\n" + outcome.display + "\n```",
+        "metadata": {
+            "parent_id": f"result_{tool_id}",
+            "id": f"raw_result_{tool_id}",
+            "status": "done",
+            "title": "Raw Output"
+        }
+    })
 
-async def call_get_multiply_tool(
-    mcp_client: Client,
-    tool_args: Dict,
-    result_messages: List[Dict],
-    tool_name: str
-) -> List[Dict] | CallToolResult | str | Dict:
-    try:
-        async with mcp_client:
-            result: CallToolResult = await mcp_client.call_tool(
-                name="get_multiply", 
-                arguments=dict(
-                    first_number=tool_args.get("first_number"),
-                    second_number=tool_args.get("second_number")
-                )
-            )
-            
-        print(f"[TOOL CALL] Get_Multiply: Result - {result}")
-        
-        # Update the status of the tool call
-        if result_messages and "metadata" in result_messages[-2]:
-            result_messages[-2]["metadata"]["status"] = "done"
-        
-        result_content = result.structured_content
-        
-        # Add a header for the tool results
-        result_messages.append({
-            "role": "assistant",
-            "content": "Here are the results from the tool:",
-            "metadata": {
-                "title": f"Tool Result for {tool_name}",
-                "status": "done",
-                "id": f"result_{tool_name}"
-            }
-        })
-        
-        result_messages.append({
-            "role": "assistant",
-            "content": "```\n" + result_content["message"] + "\n```",
-            "metadata": {
-                "parent_id": f"result_{tool_name}",
-                "id": f"raw_result_{tool_name}",
-                "status": "done",
-                "title": "Raw Output"
-            }
-        })
-    except:
-        result = "Fail to get the server response"
-        result_messages.append({
-            "role": "assistant",
-            "content": "```\n" + result + "\n```",
-            "metadata": {
-                "parent_id": f"result_{tool_name}",
-                "id": f"raw_result_{tool_name}",
-                "status": "done",
-                "title": "Raw Output"
-            }
-        })
-        
-    return result
 
 def add_tool_response(
-    result: List[Dict] | Dict | str | CallToolResult,
+    outcome: ToolOutcome,
     tool_id: str,
     tool_name: str
-) -> Optional[Dict] | Optional[str]:
-    
+) -> Dict:
     tool_response = {
         "role": "tool",
         "tool_name": tool_name,
         "tool_call_id": tool_id,
-        "content": ""
+        "content": outcome.text
     }
-    if isinstance(result, CallToolResult):
-        tool_response["content"] = result.structured_content["message"]
-        return tool_response
-    if isinstance(result, dict):
-        tool_response["content"] = result["message"]
-        return tool_response
-    if isinstance(result, str):
-        tool_response["content"] = result
-        return tool_response
-    else:
-        try:
-            result_json = json.loads(result)    
-            tool_response["content"] = result_json["message"]
-        except:
-            tool_response["content"] = result    
-        return tool_response
-
-def add_image_tool_response(
-    result: str,
-    tool_id: str,
-    tool_name: str
-) -> Optional[Dict] | Optional[str]:
-    try:
-        tool_response = {
-            "role": "tool",
-            "tool_name": tool_name,
-            "tool_call_id": tool_id,
-            "content": f"Image generated successfully with prompt {result}"
-        }
-    except:
-        tool_response = {
-            "role": "tool",
-            "tool_name": tool_name,
-            "tool_call_id": tool_id,
-            "content": "Image generated Failed."
-        }
-    
     print(f"[TOOL RESPONSE] {tool_response}")
-    return tool_response
\ No newline at end of file
+    return tool_response
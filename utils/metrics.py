@@ -0,0 +1,67 @@
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+
+class LatencyStats:
+    """Running count, mean, max and last value of a duration in seconds."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.last = seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean_s": round(self.total / self.count, 4) if self.count else 0.0,
+            "max_s": round(self.max, 4),
+            "last_s": round(self.last, 4),
+        }
+
+
+class BoundedConcurrency:
+    """Semaphore that records how long callers queue before they get a slot."""
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.waiting = 0
+        self.in_use = 0
+        self.queue_wait = LatencyStats()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[float]:
+        """Hold one slot for the duration of the block, yields the time spent queued."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        waited = time.perf_counter() - started
+        self.queue_wait.observe(waited)
+        self.in_use += 1
+        try:
+            yield waited
+        finally:
+            self.in_use -= 1
+            self._semaphore.release()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "queue_wait": self.queue_wait.snapshot(),
+        }
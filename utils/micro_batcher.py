@@ -0,0 +1,99 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class MicroBatcher:
+    """Group concurrent requests with the same key into one batched call on a worker thread.
+
+    A request opens a window of `max_wait` seconds for its key; requests with the
+    same key arriving meanwhile join it, up to `max_batch_size`. The batch then
+    runs as `run_batch(key, items)` on a single dedicated thread, which returns one
+    result per item. While a batch is running, new requests keep accumulating, so
+    under load batches fill up on their own instead of waiting out the window.
+    Callers that went away before their batch started are dropped from it.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[Hashable, List[Any]], List[Any]],
+        max_batch_size: int = 4,
+        max_wait: float = 0.05,
+        executor: Optional[ThreadPoolExecutor] = None,
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="micro-batcher")
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self._pending: Dict[Hashable, List[Tuple[Any, asyncio.Future]]] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self._ready: List[Hashable] = []
+        self._busy = False
+
+    async def submit(self, key: Hashable, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        group = self._pending.setdefault(key, [])
+        group.append((item, future))
+        if len(group) >= self.max_batch_size:
+            self._mark_ready(key)
+        elif key not in self._timers and key not in self._ready:
+            self._timers[key] = loop.call_later(self.max_wait, self._mark_ready, key)
+        return await future
+
+    def _mark_ready(self, key: Hashable):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        if key not in self._ready:
+            self._ready.append(key)
+        self._dispatch()
+
+    def _dispatch(self):
+        while not self._busy and self._ready:
+            key = self._ready.pop(0)
+            group = [(item, future) for item, future in self._pending.pop(key, []) if not future.done()]
+            batch, rest = group[:self.max_batch_size], group[self.max_batch_size:]
+            if rest:
+                self._pending[key] = rest
+                self._ready.append(key)
+            if not batch:
+                continue
+            self._busy = True
+            self.batches += 1
+            self.items += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+            running = asyncio.get_running_loop().run_in_executor(
+                self.executor, self.run_batch, key, [item for item, _ in batch]
+            )
+            running.add_done_callback(lambda done, batch=batch: self._finish(done, batch))
+
+    def _finish(self, done: asyncio.Future, batch: List[Tuple[Any, asyncio.Future]]):
+        self._busy = False
+        try:
+            results = done.result()
+        except BaseException as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+            # A short result list must not leave the remaining callers waiting forever
+            for _, future in batch[len(results):]:
+                if not future.done():
+                    future.set_exception(RuntimeError(f"Batch returned {len(results)} results for {len(batch)} items"))
+        self._dispatch()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "queued": sum(len(group) for group in self._pending.values()),
+            "busy": self._busy,
+        }
@@ -0,0 +1,256 @@
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from .logging_utils import logger
+
+NWS_CACHE_MAX_ENTRIES = int(os.getenv("NWS_CACHE_MAX_ENTRIES", "512"))
+NWS_POINTS_CACHE_PATH = os.getenv("NWS_POINTS_CACHE_PATH", "nws_points.sqlite3")
+# 2 decimals is ~1 km, well inside one 2.5 km NWS forecast grid cell
+NWS_POINTS_SNAP_DECIMALS = int(os.getenv("NWS_POINTS_SNAP_DECIMALS", "2"))
+NWS_POINTS_TTL = float(os.getenv("NWS_POINTS_TTL", str(7 * 24 * 3600)))
+
+
+def parse_cache_control(value: str) -> Dict[str, Optional[str]]:
+    directives = {}
+    for part in value.split(","):
+        name, _, arg = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"') or None
+    return directives
+
+
+def _http_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def freshness_lifetime(headers: Mapping[str, str]) -> Optional[float]:
+    """Seconds a response may be served without revalidation, `None` if it must not be stored.
+
+    Follows RFC 9111: `no-store` disables caching, `no-cache` forces revalidation,
+    `s-maxage`/`max-age` win over `Expires`, and the `Age` header is subtracted.
+    """
+    directives = parse_cache_control(headers.get("cache-control", ""))
+    if "no-store" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0.0
+    age_header = headers.get("age") or ""
+    age = float(age_header) if age_header.isdigit() else 0.0
+    for name in ("s-maxage", "max-age"):
+        value = directives.get(name)
+        if value is not None and value.isdigit():
+            return max(0.0, float(value) - age)
+    expires = _http_date(headers.get("expires"))
+    if expires is not None:
+        date = _http_date(headers.get("date")) or time.time()
+        return max(0.0, expires - date - age)
+    return 0.0
+
+
+class CachedResponse:
+    """Decoded body of a response together with its validators, fetch time and expiry (wall clock)."""
+
+    __slots__ = ("body", "etag", "last_modified", "expires_at", "fetched_at")
+
+    def __init__(self, body: Any, etag: Optional[str], last_modified: Optional[str], expires_at: float):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+        self.fetched_at = time.time()
+
+    def fresh(self) -> bool:
+        return time.time() < self.expires_at
+
+    def staleness(self) -> float:
+        """Seconds since the entry expired, 0 while it is fresh."""
+        return max(0.0, time.time() - self.expires_at)
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CachedResponse":
+        entry = cls(data["body"], data["etag"], data["last_modified"], data["expires_at"])
+        entry.fetched_at = data["fetched_at"]
+        return entry
+
+
+class HttpCache:
+    """LRU of JSON responses keyed by URL that honors `Cache-Control`, `Expires` and validators.
+
+    Fresh entries are served without a request. Expired entries are kept: those
+    with an `ETag` or `Last-Modified` make the next request conditional, so a
+    `304 Not Modified` only has to refresh the expiry, and any of them can still be
+    served stale while NWS is unreachable.
+
+    With a `shared` store, entries are written through to it and a worker that
+    has no fresh copy of its own picks up the one another worker fetched. Shared
+    rows are kept `shared_retention` seconds past their expiry for stale serving.
+    Shared reads and writes (and their JSON encoding) run in worker threads, the
+    bodies can be megabytes and must not stall the event loop.
+    """
+
+    def __init__(self, max_entries: int = NWS_CACHE_MAX_ENTRIES, shared=None, shared_retention: float = 0.0):
+        self.max_entries = max(1, max_entries)
+        self.shared = shared
+        self.shared_retention = shared_retention
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        self.stale_served = 0
+
+    async def get(self, url: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(url)
+        if entry is not None:
+            self._entries.move_to_end(url)
+        if self.shared is not None and (entry is None or not entry.fresh()):
+            row = await asyncio.to_thread(self.shared.get, "nws", url)
+            if row is not None and (entry is None or row[0]["fetched_at"] > entry.fetched_at):
+                entry = CachedResponse.from_dict(row[0])
+                self._remember(url, entry, share=False)
+        return entry
+
+    def _remember(self, url: str, entry: CachedResponse, share: bool = True):
+        self._entries[url] = entry
+        self._entries.move_to_end(url)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        if share and self.shared is not None:
+            self._share(url, entry)
+
+    def _share(self, url: str, entry: CachedResponse):
+        """Write an entry through to the shared store in the background, callers don't wait for it."""
+        writing = asyncio.get_running_loop().run_in_executor(
+            None, self.shared.set, "nws", url, entry.to_dict(), entry.expires_at + self.shared_retention
+        )
+
+        def done(writing: asyncio.Future):
+            if not writing.cancelled() and writing.exception() is not None:
+                logger.info(f"[NWS_CACHE] Failed to share {url}: {writing.exception()}")
+
+        writing.add_done_callback(done)
+
+    def store(self, url: str, body: Any, headers: Mapping[str, str]) -> CachedResponse:
+        lifetime = freshness_lifetime(headers)
+        entry = CachedResponse(body, headers.get("etag"), headers.get("last-modified"), time.time() + (lifetime or 0.0))
+        if lifetime is None:
+            self._entries.pop(url, None)
+            return entry
+        self._remember(url, entry)
+        return entry
+
+    def revalidated(self, url: str, entry: CachedResponse, headers: Mapping[str, str]) -> CachedResponse:
+        """Apply the headers of a `304 Not Modified` to the stored entry."""
+        lifetime = freshness_lifetime(headers)
+        entry.expires_at = time.time() + (lifetime or 0.0)
+        entry.etag = headers.get("etag", entry.etag)
+        entry.last_modified = headers.get("last-modified", entry.last_modified)
+        entry.fetched_at = time.time()
+        self._remember(url, entry)
+        return entry
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "revalidations": self.revalidations,
+            "misses": self.misses,
+            "stale_served": self.stale_served,
+        }
+
+
+class PointsCache:
+    """Persistent map from snapped coordinates to the NWS forecast URL of their grid cell.
+
+    `/points/{lat},{lon}` only resolves a location to its forecast office and grid,
+    which practically never changes, so the mapping is kept in SQLite across restarts.
+    Coordinates are rounded to `snap_decimals` so nearby locations share an entry.
+    """
+
+    def __init__(
+        self,
+        path: str = NWS_POINTS_CACHE_PATH,
+        snap_decimals: int = NWS_POINTS_SNAP_DECIMALS,
+        ttl: float = NWS_POINTS_TTL,
+    ):
+        self.path = path
+        self.snap_decimals = snap_decimals
+        self.ttl = ttl
+        self._memory: Dict[Tuple[float, float], Tuple[str, float]] = {}
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def snap(self, latitude: float, longtitude: float) -> Tuple[float, float]:
+        return round(float(latitude), self.snap_decimals), round(float(longtitude), self.snap_decimals)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            # Several MCP workers may share the file
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS points ("
+                "lat REAL NOT NULL, lon REAL NOT NULL, forecast_url TEXT NOT NULL, "
+                "stored_at REAL NOT NULL, PRIMARY KEY (lat, lon))"
+            )
+            self._db.commit()
+        return self._db
+
+    async def get(self, latitude: float, longtitude: float) -> Optional[str]:
+        key = self.snap(latitude, longtitude)
+        entry = self._memory.get(key)
+        if entry is None:
+            # The file is shared with the other workers, a locked database must not stall the event loop
+            row = await asyncio.to_thread(self._load, key)
+            if row is None:
+                return None
+            entry = self._memory[key] = (row[0], row[1])
+        forecast_url, stored_at = entry
+        if time.time() - stored_at > self.ttl:
+            return None
+        return forecast_url
+
+    def _load(self, key: Tuple[float, float]) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            return self._connection().execute(
+                "SELECT forecast_url, stored_at FROM points WHERE lat = ? AND lon = ?", key
+            ).fetchone()
+
+    async def put(self, latitude: float, longtitude: float, forecast_url: str):
+        key = self.snap(latitude, longtitude)
+        stored_at = time.time()
+        self._memory[key] = (forecast_url, stored_at)
+        await asyncio.to_thread(self._store, key, forecast_url, stored_at)
+
+    def _store(self, key: Tuple[float, float], forecast_url: str, stored_at: float):
+        with self._lock:
+            db = self._connection()
+            db.execute(
+                "INSERT OR REPLACE INTO points (lat, lon, forecast_url, stored_at) VALUES (?, ?, ?, ?)",
+                (*key, forecast_url, stored_at)
+            )
+            db.commit()
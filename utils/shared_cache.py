@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Any, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows, a single process is the leader
+    fcntl = None
+
+from .logging_utils import logger
+
+# SQLite file shared by all MCP worker processes, empty keeps every cache private to its process
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "")
+SHARED_CACHE_PRUNE_EVERY = 256
+
+
+class SharedCache:
+    """Namespaced JSON key/value store in SQLite, shared between processes.
+
+    Runs in WAL mode so readers in other workers never block on the writer. Each
+    process opens its own connection lazily, rows past their `expires_at` are
+    ignored and periodically deleted.
+    """
+
+    def __init__(self, path: str = SHARED_CACHE_PATH):
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._db is None or self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "updated_at REAL NOT NULL, expires_at REAL, PRIMARY KEY (namespace, key))"
+            )
+            self._db.commit()
+            self._pid = os.getpid()
+        return self._db
+
+    def get(self, namespace: str, key: str) -> Optional[Tuple[Any, float]]:
+        """Stored value and the time it was written, `None` when missing or expired."""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT value, updated_at, expires_at FROM entries WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+        if row is None or (row[2] is not None and row[2] < time.time()):
+            return None
+        return json.loads(row[0]), row[1]
+
+    def updated_at(self, namespace: str, key: str) -> Optional[float]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT updated_at FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, namespace: str, key: str, value: Any, expires_at: Optional[float] = None):
+        data = json.dumps(value, separators=(",", ":"))
+        with self._lock:
+            db = self._connection()
+            db.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, updated_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (namespace, key, data, time.time(), expires_at)
+            )
+            self._writes += 1
+            if self._writes % SHARED_CACHE_PRUNE_EVERY == 0:
+                db.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),))
+            db.commit()
+
+
+class FileLock:
+    """Non-blocking, process-wide exclusive lock on a file, released by the OS if the holder dies."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    @property
+    def held(self) -> bool:
+        return self._file is not None
+
+    def try_acquire(self) -> bool:
+        if self._file is not None:
+            return True
+        if fcntl is None:
+            self._file = True
+            return True
+        f = open(self.path, "a+")
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self._file = f
+        logger.info(f"[SHARED_CACHE] Process {os.getpid()} holds {self.path}")
+        return True
+
+    def release(self):
+        if self._file not in (None, True):
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+        self._file = None
+
+
+shared_cache = SharedCache(SHARED_CACHE_PATH) if SHARED_CACHE_PATH else None
@@ -0,0 +1,86 @@
+import os
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+TOOL_CACHE_MAX_ENTRIES = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "1024"))
+# JSON object of per-tool TTLs in seconds overriding the server annotations, e.g. {"get_alerts": 60}
+TOOL_CACHE_TTLS = json.loads(os.getenv("TOOL_CACHE_TTLS", "{}"))
+
+
+def canonical_arguments(tool_args: Dict) -> str:
+    """Stable text form of tool arguments: sorted keys, trimmed strings, no whitespace."""
+    def normalize(value: Any) -> Any:
+        if isinstance(value, str):
+            return value.strip()
+        if isinstance(value, dict):
+            return {key: normalize(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [normalize(item) for item in value]
+        return value
+
+    return json.dumps(normalize(tool_args), sort_keys=True, separators=(",", ":"), default=str)
+
+
+def tool_cache_key(tool_name: str, tool_args: Dict) -> str:
+    return f"{tool_name}:{canonical_arguments(tool_args)}"
+
+
+class ToolResultCache:
+    """Size-bounded LRU cache of tool results with a TTL per tool.
+
+    Tools are only cached when they have a positive TTL and are not annotated as
+    non-idempotent or destructive, so e.g. `generate_image` is never served from here.
+    """
+
+    def __init__(self, max_entries: int = TOOL_CACHE_MAX_ENTRIES, ttls: Optional[Dict[str, float]] = None):
+        self.max_entries = max(1, max_entries)
+        self.ttls = TOOL_CACHE_TTLS if ttls is None else ttls
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def ttl_for(self, tool_name: str, annotations: Optional[Dict] = None, declared_ttl: float = 0) -> float:
+        """TTL of a tool: the `TOOL_CACHE_TTLS` override, else the TTL the server declared."""
+        annotations = annotations or {}
+        if annotations.get("idempotentHint") is False or annotations.get("destructiveHint") is True:
+            return 0
+        return float(self.ttls.get(tool_name, declared_ttl))
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, ttl: float):
+        if ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
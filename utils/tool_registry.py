@@ -0,0 +1,176 @@
+import os
+import time
+import json
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import mcp.types
+
+from .logging_utils import logger
+from .tools import tool_definition_list
+from .mcp_session_pool import MCPSessionPool
+from .mcp_utils import (
+    ToolOutcome,
+    call_mcp_tool,
+    call_image_describe_tool,
+    text_result_adapter,
+    describe_result_adapter,
+    image_result_adapter,
+)
+
+TOOL_REGISTRY_TTL = float(os.getenv("TOOL_REGISTRY_TTL", "300"))
+
+ToolHandler = Callable[..., Awaitable[Any]]
+ResultAdapter = Callable[[str, Dict, Any], ToolOutcome]
+
+# Tools that need more than forwarding their arguments, everything else uses the defaults
+DEFAULT_HANDLERS: Dict[str, ToolHandler] = {
+    "describe_image": call_image_describe_tool,
+}
+DEFAULT_ADAPTERS: Dict[str, ResultAdapter] = {
+    "generate_image": image_result_adapter,
+    "describe_image": describe_result_adapter,
+}
+
+# Used until the server annotations are loaded, see `direct_answer` and `cache_ttl`
+DEFAULT_DIRECT_ANSWERS: Dict[str, str] = {
+    "get_multiply": "{first_number} multiplied by {second_number} is {result}.",
+    "generate_image": "Here is the generated image for: {prompt}",
+}
+
+DEFAULT_TOOL_CACHE_TTLS: Dict[str, float] = {
+    "get_alerts": 120,
+    "get_alerts_batch": 120,
+    "get_forecast": 900,
+    "get_forecast_batch": 900,
+    "get_multiply": 3600,
+}
+
+
+def mcp_tool_to_openai(tool: mcp.types.Tool) -> Dict:
+    """Convert an MCP tool listing into the OpenAI function-calling format."""
+    schema = dict(tool.inputSchema or {})
+    schema.pop("title", None)
+    schema.setdefault("type", "object")
+    schema.setdefault("properties", {})
+
+    annotations = tool.annotations.model_dump(exclude_none=True) if tool.annotations else {}
+    description = (tool.description or annotations.get("title") or tool.name).strip()
+    return {
+        "type": "function",
+        "function": {
+            "name": tool.name,
+            "description": description,
+            "parameters": schema,
+        },
+    }
+
+
+class ToolRegistry:
+    """Tool schemas, handlers and result adapters keyed by tool name.
+
+    Schemas come from the MCP server's `list_tools` and are refreshed at most once
+    per `ttl` seconds, so tools added to the server are picked up without a client
+    redeploy. Until the server has been reached the static definitions of
+    `utils/tools.py` are used.
+    """
+
+    def __init__(self, fallback_definitions: List[Dict] = tool_definition_list, ttl: float = TOOL_REGISTRY_TTL):
+        self.ttl = ttl
+        self._handlers: Dict[str, ToolHandler] = dict(DEFAULT_HANDLERS)
+        self._adapters: Dict[str, ResultAdapter] = dict(DEFAULT_ADAPTERS)
+        self._annotations: Dict[str, Dict] = {}
+        self._loaded_at = 0.0
+        self._refresh_lock: Optional[asyncio.Lock] = None
+        self._set_definitions(fallback_definitions)
+
+    def _set_definitions(self, definitions: List[Dict]):
+        # Sorted, canonical definitions keep the tool block of the prompt byte-stable
+        definitions = sorted(definitions, key=lambda definition: definition["function"]["name"])
+        self._definitions = {definition["function"]["name"]: definition for definition in definitions}
+        self.definitions = definitions
+        self.version = hashlib.sha1(json.dumps(definitions, sort_keys=True).encode()).hexdigest()[:12]
+
+    def register_handler(self, tool_name: str, handler: ToolHandler):
+        self._handlers[tool_name] = handler
+
+    def register_adapter(self, tool_name: str, adapter: ResultAdapter):
+        self._adapters[tool_name] = adapter
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._definitions)
+
+    def __contains__(self, tool_name: str) -> bool:
+        return tool_name in self._definitions
+
+    def handler(self, tool_name: str) -> ToolHandler:
+        return self._handlers.get(tool_name, call_mcp_tool)
+
+    def adapter(self, tool_name: str) -> ResultAdapter:
+        return self._adapters.get(tool_name, text_result_adapter)
+
+    def annotations(self, tool_name: str) -> Dict:
+        return self._annotations.get(tool_name, {})
+
+    def direct_answer(self, tool_name: str) -> Optional[str]:
+        """Template of the final answer for tools whose result needs no LLM synthesis.
+
+        Declared on the server with a `directAnswer` tool annotation.
+        """
+        if not self._annotations:
+            return DEFAULT_DIRECT_ANSWERS.get(tool_name)
+        return self.annotations(tool_name).get("directAnswer")
+
+    def cache_ttl(self, tool_name: str) -> float:
+        """Seconds a result of this tool may be reused, declared with a `cacheTtl` annotation."""
+        if not self._annotations:
+            return DEFAULT_TOOL_CACHE_TTLS.get(tool_name, 0)
+        return float(self.annotations(tool_name).get("cacheTtl", 0))
+
+    def parameters(self, tool_name: str) -> Dict:
+        definition = self._definitions.get(tool_name)
+        return definition["function"]["parameters"].get("properties", {}) if definition else {}
+
+    def filter_arguments(self, tool_name: str, tool_args: Dict) -> Dict:
+        """Drop arguments the tool does not declare, the server rejects unknown ones."""
+        properties = self.parameters(tool_name)
+        if not properties:
+            return tool_args
+        return {key: value for key, value in tool_args.items() if key in properties}
+
+    async def refresh(self, mcp_pool: MCPSessionPool) -> bool:
+        """Reload the tool schemas from the server, returns whether they changed."""
+        async with mcp_pool.session() as mcp_client:
+            tools: List[mcp.types.Tool] = await mcp_client.list_tools()
+
+        previous_version = self.version
+        self._annotations = {
+            tool.name: tool.annotations.model_dump(exclude_none=True) if tool.annotations else {}
+            for tool in tools
+        }
+        self._set_definitions([mcp_tool_to_openai(tool) for tool in tools])
+        self._loaded_at = time.monotonic()
+
+        changed = self.version != previous_version
+        if changed:
+            logger.info(f"[TOOL_REGISTRY] Loaded {len(tools)} tools, version {self.version}")
+        return changed
+
+    async def ensure_fresh(self, mcp_pool: MCPSessionPool):
+        """Refresh the schemas when the TTL expired, keeping the cached ones on failure."""
+        if self._loaded_at and time.monotonic() - self._loaded_at < self.ttl:
+            return
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        if self._refresh_lock.locked():
+            # Another turn is already refreshing, use the current schemas meanwhile
+            return
+        async with self._refresh_lock:
+            try:
+                await self.refresh(mcp_pool)
+            except Exception as e:
+                # Retry on the next TTL window rather than on every turn
+                self._loaded_at = time.monotonic()
+                logger.info(f"[TOOL_REGISTRY] Refresh failed, keeping version {self.version}: {e}")
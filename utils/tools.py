@@ -16,13 +16,17 @@ def get_tool_definition():
                     },
                     "width": {
                         "type": "integer",
-                        "description": "Image width (default: 512)",
-                        "default": 512
+                        "description": "Image width, only when the user asks for a size (default: the tier's size)"
                     },
                     "height": {
                         "type": "integer",
-                        "description": "Image height (default: 512)",
-                        "default": 512
+                        "description": "Image height, only when the user asks for a size (default: the tier's size)"
+                    },
+                    "tier": {
+                        "type": "string",
+                        "description": "Speed/quality tier: 'preview' (fast, up to 512px), 'standard' or 'high' (slow, best quality). Leave empty for the server default.",
+                        "enum": ["", "preview", "standard", "high"],
+                        "default": ""
                     }
                 },
                 "required": ["prompt"]
@@ -60,6 +64,15 @@ def get_tool_definition():
                         "type": "string",
                         "description": "Two-letter US state code (e.g. CA, NY)"
                     },
+                    "compact": {
+                        "type": "boolean",
+                        "description": "One row per event, most severe first, instead of full descriptions"
+                    },
+                    "cursor": {
+                        "type": "integer",
+                        "description": "Row to continue from when a compact result said more are available",
+                        "default": 0
+                    },
                 },
                 "required": ["state"]
             },
@@ -70,7 +83,7 @@ def get_tool_definition():
         "type": "function",
         "function": {
             "name": "get_forecast",
-            "description": "Get weather forecast for a location from an API",
+            "description": "Get weather forecast for a location, given by its coordinates or by a US place name, from an API",
             "parameters": {
                 "type": "object",
                 "properties": {
@@ -82,8 +95,74 @@ def get_tool_definition():
                         "type": "string",
                         "description": "longtitude of the location"
                     },
+                    "place": {
+                        "type": "string",
+                        "description": "US city instead of coordinates (e.g. \"Austin, TX\")"
+                    },
+                    "compact": {
+                        "type": "boolean",
+                        "description": "One short table row per period instead of detailed forecast blocks"
+                    },
+                    "cursor": {
+                        "type": "integer",
+                        "description": "Row to continue from when a compact result said more are available",
+                        "default": 0
+                    },
+                },
+                "required": [],
+            },
+            "strict": True,
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_alerts_batch",
+            "description": "Get weather alerts for several US states at once from an API.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "states": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Two-letter US state codes (e.g. [\"CA\", \"NY\"])"
+                    },
+                    "compact": {
+                        "type": "boolean",
+                        "description": "One row per event, most severe first, instead of full descriptions"
+                    },
+                },
+                "required": ["states"]
+            },
+            "strict": True,
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_forecast_batch",
+            "description": "Get weather forecasts for several locations at once from an API",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "locations": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "latitude": {"type": "number"},
+                                "longtitude": {"type": "number"},
+                                "place": {"type": "string"}
+                            }
+                        },
+                        "description": "Locations, each with a latitude and a longtitude or a US place name (e.g. {\"place\": \"Austin, TX\"})"
+                    },
+                    "compact": {
+                        "type": "boolean",
+                        "description": "One short table row per period instead of detailed forecast blocks"
+                    },
                 },
-                "required": ["latitude", "longtitude"],
+                "required": ["locations"],
             },
             "strict": True,
         },
@@ -1,27 +1,156 @@
-import requests
-from typing import Any
+import os
+import time
+import asyncio
+from datetime import datetime
+from typing import Any, List, NamedTuple, Optional
 
 from .logging_utils import logger
+from .http_client import AsyncHttpPool
+from .nws_cache import CachedResponse, HttpCache, PointsCache
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .single_flight import SingleFlight
+from .shared_cache import shared_cache
 
 # Constants
 NWS_API_BASE = "https://api.weather.gov"
 USER_AGENT = "weather-app/1.0"
+NWS_TIMEOUT = float(os.getenv("NWS_TIMEOUT", "10"))
+# Consecutive failures that open the circuit, and seconds until a probe request is let through
+NWS_BREAKER_THRESHOLD = int(os.getenv("NWS_BREAKER_THRESHOLD", "5"))
+NWS_BREAKER_RESET = float(os.getenv("NWS_BREAKER_RESET", "30"))
+# Expired responses are served as-is for this long while they are refreshed in the background
+NWS_STALE_WHILE_REVALIDATE = float(os.getenv("NWS_STALE_WHILE_REVALIDATE", "60"))
+# and for this long, with a note, when NWS fails or the circuit is open
+NWS_STALE_IF_ERROR = float(os.getenv("NWS_STALE_IF_ERROR", str(6 * 3600)))
+# Size cap of compact tool output, the rest is reachable through a cursor
+WEATHER_COMPACT_MAX_ITEMS = int(os.getenv("WEATHER_COMPACT_MAX_ITEMS", "10"))
+WEATHER_COMPACT_MAX_CHARS = int(os.getenv("WEATHER_COMPACT_MAX_CHARS", "1200"))
 
-async def make_nws_request(url: str) -> dict[str, Any]:
-    """Make a request to the NWS API with proper error handling."""
-    headers = {
+SEVERITY_ORDER = ["Extreme", "Severe", "Moderate", "Minor", "Unknown"]
+
+# One pooled client for every NWS call, connections are kept alive between tool calls
+nws_http = AsyncHttpPool(
+    headers={
         "User-Agent": USER_AGENT,
         "Accept": "application/geo+json"
-    }
+    },
+    timeout=NWS_TIMEOUT,
+    per_host_concurrency=int(os.getenv("NWS_CONCURRENCY", "8"))
+)
+# Responses are reused as long as NWS' own cache headers allow, then revalidated
+nws_cache = HttpCache(shared=shared_cache, shared_retention=NWS_STALE_IF_ERROR)
+points_cache = PointsCache()
+nws_breaker = CircuitBreaker("nws", NWS_BREAKER_THRESHOLD, NWS_BREAKER_RESET)
+nws_flights = SingleFlight()
+_background_refreshes = set()
+
+class NwsResponse:
+    """Body of an NWS response, `degraded` when it is a stale copy served because NWS failed."""
+
+    __slots__ = ("data", "fetched_at", "degraded")
+
+    def __init__(self, entry: CachedResponse, degraded: bool = False):
+        self.data = entry.body
+        self.fetched_at = entry.fetched_at
+        self.degraded = degraded
+
+async def _fetch_nws(url: str) -> Optional[CachedResponse]:
+    """One upstream request through the circuit breaker, `None` when NWS rejects the request."""
+    if not nws_breaker.allow():
+        raise CircuitOpenError(f"NWS circuit is open, not requesting {url}")
+    cached = await nws_cache.get(url)
     try:
-        response = requests.get(url, headers=headers, timeout=30.0)
-        print(f"+++ GOT RESPONSE: {response.status_code}")
-        response.raise_for_status()  # Raises an exception for 4XX/5XX responses
-        return response.json()
+        # With a stale copy to fall back on, fail after one attempt instead of retrying
+        response = await nws_http.get(
+            url,
+            headers=cached.conditional_headers() if cached else None,
+            retry=cached is None
+        )
     except Exception:
-        logger.info("Fail to get response")
+        nws_breaker.record_failure()
+        raise
+    print(f"+++ GOT RESPONSE: {response.status_code}")
+    if response.status_code >= 500 or response.status_code == 429:
+        nws_breaker.record_failure()
+        response.raise_for_status()
+    nws_breaker.record_success()
+
+    if response.status_code == 304 and cached is not None:
+        nws_cache.revalidations += 1
+        return nws_cache.revalidated(url, cached, response.headers)
+    if response.status_code >= 400:
+        logger.info(f"NWS returned {response.status_code} for {url}")
+        return None
+    nws_cache.misses += 1
+    return nws_cache.store(url, response.json(), response.headers)
+
+def _refresh_in_background(url: str):
+    task = asyncio.ensure_future(nws_flights.do(url, lambda: _fetch_nws(url)))
+    _background_refreshes.add(task)
+
+    def done(task: asyncio.Future):
+        _background_refreshes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.info(f"Background refresh of {url} failed: {task.exception()}")
+
+    task.add_done_callback(done)
+
+async def fetch_nws(url: str) -> Optional[NwsResponse]:
+    """Request an NWS URL through the response cache, with stale fallbacks when NWS is failing."""
+    cached = await nws_cache.get(url)
+    if cached is not None and (cached.fresh() or cached.staleness() <= NWS_STALE_WHILE_REVALIDATE):
+        nws_cache.hits += 1
+        if not cached.fresh():
+            _refresh_in_background(url)
+        return NwsResponse(cached)
+    try:
+        # Concurrent requests for the same URL share one upstream request
+        entry = await nws_flights.do(url, lambda: _fetch_nws(url))
+        return NwsResponse(entry) if entry is not None else None
+    except Exception as e:
+        logger.info(f"Fail to get response: {e}")
+        if cached is not None and cached.staleness() <= NWS_STALE_IF_ERROR:
+            nws_cache.stale_served += 1
+            return NwsResponse(cached, degraded=True)
+        return None
+
+async def make_nws_request(url: str) -> dict[str, Any]:
+    """Make a request to the NWS API with proper error handling."""
+    result = await fetch_nws(url)
+    return result.data if result is not None else None
+
+class WeatherAnswer(NamedTuple):
+    """Text of a weather tool answer and how much it can be trusted."""
+    text: str
+    # Built from a stale copy while NWS is failing
+    degraded: bool = False
+    # NWS gave no usable answer, `text` says why
+    failed: bool = False
+
+def freshness_note(result: NwsResponse) -> str:
+    """Line to append to a tool answer built from a stale NWS response."""
+    if not result.degraded:
+        return ""
+    minutes = int((time.time() - result.fetched_at) // 60)
+    return (
+        "\n\nNote: the National Weather Service cannot be reached right now, "
+        f"this data was last updated {minutes} minutes ago."
+    )
+
+async def get_forecast_url(latitude: float, longtitude: float) -> Optional[str]:
+    """Resolve a location to its NWS forecast URL, from the points cache when possible."""
+    forecast_url = await points_cache.get(latitude, longtitude)
+    if forecast_url:
+        return forecast_url
+
+    points_data = await make_nws_request(f"{NWS_API_BASE}/points/{latitude},{longtitude}")
+    if not points_data:
         return None
 
+    forecast_url = points_data["properties"]["forecast"]
+    await points_cache.put(latitude, longtitude, forecast_url)
+    return forecast_url
+
 def format_alert(feature: dict) -> str:
     """Format an alert feature into a readable string."""
     props: dict = feature["properties"]
@@ -31,4 +160,78 @@ Area: {props.get('areaDesc', 'Unknown')}
 Severity: {props.get('severity', 'Unknown')}
 Description: {props.get('description', 'No description available')}
 Instructions: {props.get('instruction', 'No specific instructions provided')}
-"""
\ No newline at end of file
+"""
+
+# Only compact results are paginated, the next page has to be asked for in compact mode too
+CONTINUE_HINT = "call again with compact=true and cursor="
+
+def continue_with(text: str, call: str) -> str:
+    """Point the cursor hint of a paginated result at a single-item tool call, for batch results."""
+    return text.replace(CONTINUE_HINT, f"call {call}, compact=true and cursor=")
+
+def paginate_rows(header: str, rows: List[str], cursor: int = 0) -> str:
+    """Header plus as many rows from `cursor` on as fit the compact size cap, with a cursor to the rest."""
+    if cursor >= len(rows):
+        return "No more results." if rows else header
+    lines, size, end = [header], len(header), cursor
+    for row in rows[cursor:]:
+        if end - cursor >= WEATHER_COMPACT_MAX_ITEMS or (end > cursor and size + len(row) + 1 > WEATHER_COMPACT_MAX_CHARS):
+            break
+        lines.append(row)
+        size += len(row) + 1
+        end += 1
+    if end < len(rows):
+        lines.append(f"({len(rows) - end} more available, {CONTINUE_HINT}{end})")
+    return "\n".join(lines)
+
+def format_forecast_compact(periods: List[dict], cursor: int = 0) -> str:
+    """Forecast periods as one table row each, using the short forecast text."""
+    rows = []
+    for period in periods:
+        rain = (period.get("probabilityOfPrecipitation") or {}).get("value")
+        rows.append(
+            f"{period['name']} | {period['temperature']}°{period['temperatureUnit']} | "
+            f"{period['windSpeed']} {period['windDirection']} | "
+            f"{'-' if rain is None else f'{rain}%'} | {period.get('shortForecast', '')}"
+        )
+    return paginate_rows("Period | Temp | Wind | Rain | Forecast", rows, cursor)
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+def format_alerts_compact(features: List[dict], cursor: int = 0) -> str:
+    """Alerts as one row per event and severity, most severe first.
+
+    NWS issues the same event for many overlapping zones and keeps superseded
+    updates active, so alerts sharing an event and severity are merged into one
+    row with their areas combined and the latest end time.
+    """
+    groups = {}
+    for feature in features:
+        props = feature["properties"]
+        key = (props.get("event", "Unknown"), props.get("severity") or "Unknown")
+        group = groups.setdefault(key, {"count": 0, "areas": {}, "until": None})
+        group["count"] += 1
+        for area in (props.get("areaDesc") or "").split(";"):
+            if area.strip():
+                group["areas"][area.strip()] = None
+        until = _parse_time(props.get("ends") or props.get("expires"))
+        if until is not None and (group["until"] is None or until > group["until"]):
+            group["until"] = until
+
+    def rank(key):
+        severity = key[1]
+        return (SEVERITY_ORDER.index(severity) if severity in SEVERITY_ORDER else len(SEVERITY_ORDER), key[0])
+
+    rows = []
+    for event, severity in sorted(groups, key=rank):
+        group = groups[(event, severity)]
+        areas = list(group["areas"])
+        area_text = "; ".join(areas[:3]) + (f" (+{len(areas) - 3} more)" if len(areas) > 3 else "")
+        until = group["until"].strftime("%a %d %H:%M") if group["until"] else "-"
+        count = f" x{group['count']}" if group["count"] > 1 else ""
+        rows.append(f"{severity} | {event}{count} | {until} | {area_text}")
+    return paginate_rows("Severity | Event | Until | Areas", rows, cursor)